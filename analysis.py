@@ -0,0 +1,91 @@
+"""
+Summary statistics of prevalence curves, ie, of the prevalence r (the mean
+final fraction of recovered individuals) as a function of the vaccination
+fraction v. The functions here work on whole arrays of curves at once: the
+prevalences R may have any shape (..., m), with the last axis running over
+the m vaccination fractions V (by default, 0, 0.01, ..., 0.99) and the other
+axes over, say, strategies and mean degrees. They do not need matplotlib,
+and are used by the plotting scripts.
+"""
+
+import numpy
+
+# The default grid of vaccination fractions, and its step.
+STEP = 0.01
+
+def fractions(R, V = None):
+    """
+    Return the vaccination fractions of the prevalences R, ie, V as an array,
+    or the default grid if V is None.
+    """
+    if V is None:
+        return STEP * numpy.arange(numpy.shape(R)[-1])
+    return numpy.asarray(V, dtype = numpy.float64)
+
+def widths(V):
+    """
+    Return the widths of the intervals [V[j], V[j + 1]) covered by the
+    vaccination fractions V, the last one ending at 1.
+    """
+    return numpy.diff(numpy.append(V, 1.0))
+
+def total(X):
+    """
+    Return the sums of X over the last axis, accumulated from left to right
+    (as Python's sum does, unlike numpy.sum), so that they round the same way
+    as the sums originally computed by the plotting scripts.
+    """
+    X = numpy.asarray(X, dtype = numpy.float64)
+    if X.shape[-1] == 0:
+        return X.sum(axis = -1)
+    return numpy.cumsum(X, axis = -1)[..., -1]
+
+def p_index(R, V = None, method = "riemann"):
+    """
+    Return the P-index, ie, the area under the prevalence curves R (see the
+    module docstring), over the last axis. With method "riemann" (the
+    default), the area is the left Riemann sum, which on the default grid is
+    sum(0.01 * r) as originally computed by the plotting scripts; with method
+    "trapezoid", it is given by the trapezoidal rule over V, which suits
+    non-uniform grids.
+    """
+    R = numpy.asarray(R, dtype = numpy.float64)
+    if method == "riemann":
+        if V is None:
+            return total(STEP * R)
+        return (R * widths(fractions(R, V))).sum(axis = -1)
+    if method == "trapezoid":
+        dV = numpy.diff(fractions(R, V))
+        return ((R[..., 1:] + R[..., :-1]) / 2 * dV).sum(axis = -1)
+    raise ValueError("unknown P-index method %s" %(method))
+
+def vstar(R, V = None, epsilon = 1e-2, method = "count"):
+    """
+    Return the critical vaccination threshold vstar of the prevalence curves
+    R (see the module docstring), over the last axis. With method "count"
+    (the default), vstar is the total width of the intervals of fractions at
+    which the prevalence is above epsilon, which on the default grid is 0.01
+    times their number, as originally computed by the plotting scripts; with
+    method "interpolated", it is the fraction at which the prevalence drops
+    to epsilon for the last time, linearly interpolated between the grid
+    points on either side (0 if it never exceeds epsilon, and 1 if it does
+    not drop by the last fraction).
+    """
+    R = numpy.asarray(R, dtype = numpy.float64)
+    above = R > epsilon
+    if method == "count":
+        if V is None:
+            return total(STEP * above)
+        return (above * widths(fractions(R, V))).sum(axis = -1)
+    if method == "interpolated":
+        V = fractions(R, V)
+        m = R.shape[-1]
+        last = m - 1 - numpy.argmax(above[..., ::-1], axis = -1)
+        j = numpy.minimum(last, m - 2)
+        r0 = numpy.take_along_axis(R, j[..., None], axis = -1)[..., 0]
+        r1 = numpy.take_along_axis(R, j[..., None] + 1, axis = -1)[..., 0]
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            v = V[j] + (r0 - epsilon) / (r0 - r1) * (V[j + 1] - V[j])
+        v = numpy.where(last == m - 1, 1.0, v)
+        return numpy.where(above.any(axis = -1), v, 0.0)
+    raise ValueError("unknown vstar method %s" %(method))
@@ -1,23 +1,5 @@
-import igraph, networkx, pickle, operator, random, sys
-
-def random_vertex(G):
-    """ 
-    Return a random vertex from G.
-    """
-    return random.choice(G.nodes())
-
-def neighbors(G, i):
-    """
-    Return the neighbors of vertex i in G.
-    """
-    return G.neighbors(i)
-
-def random_neighbor(G, i):
-    """
-    Return a random neighbor of vertex i in G.
-    """
-    l = neighbors(G, i)
-    return random.choice(l) if len(l) > 0 else None
+import argparse, disease, graph_cache, heapq, igraph, multiprocessing
+import networkx, numpy, operator, random, sequence_store, sys
 
 def eigenvector_centrality(G):
     """
@@ -30,177 +12,428 @@ def eigenvector_centrality(G):
     return {int(tempG.vs[i]["name"]): v for i, v in 
             enumerate(tempG.eigenvector_centrality())}
 
-def main(args):
+def sampled_closeness_centrality(G, samples, seed = None):
     """
-    Reads in a network in GraphML format, computes the order in which the 
-    vertices of the network must be removed using various (random walk, 
-    referral, betweenness, closeness, degree, and eigenvector) attack 
-    strategies and simultaneous and sequential attack modes. The orderings 
-    are pickled in a file.
+    Returns a map that maps a vertex id to an estimate of its closeness 
+    centrality in G, computed from the breadth-first searches from samples 
+    randomly chosen source vertices (rather than from all the vertices). The 
+    estimate of the closeness of a vertex v uses the mean distance to v from 
+    the sampled sources that reach it, and is scaled by the size of the 
+    component of v as in networkx.closeness_centrality.
     """
-    if len(args) != 1:
-        sys.exit("Usage: python attack_sequence.py <graphml file>")
-
-    ifname = args[0]
-    G = networkx.read_graphml(ifname)
-    G = networkx.convert_node_labels_to_integers(G)
-    Vcount = len(G)
-
-    # Random walk.
-    print("Random walk (simultaneous) attack...")
-    Gcopy = G.copy()
-    RWK_SIM = []
-    count = 0
-    p = random_vertex(Gcopy)
-    while count < Vcount:
-        q = random_neighbor(Gcopy, p)
-        if q == None:
-            if p in RWK_SIM:
-                continue
-            else:
-                RWK_SIM.append(p)
-                count += 1
-                p = random_vertex(Gcopy)
-                continue
-        else:
-            p = q
-            if q in RWK_SIM:
-                continue
-        RWK_SIM.append(p)
-        count += 1
-    print("Random walk (sequential) attack...")
-    RWK_SEQ = []
-    count = 0
-    p = random_vertex(Gcopy)
-    while count < Vcount:
-        q = random_neighbor(Gcopy, p) if p in Gcopy else random_vertex(Gcopy)
-        if q == None:
-            if p in RWK_SEQ:
-                continue
-            else:
-                RWK_SEQ.append(p)
-                Gcopy.remove_node(p)                
-                count += 1
-                p = random_vertex(Gcopy)
-                continue
+    n = len(G)
+    rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+    sources = rng.sample(list(G.nodes()), min(samples, n))
+    total = dict((v, 0) for v in G.nodes())
+    count = dict((v, 0) for v in G.nodes())
+    for s in sources:
+        for v, d in networkx.single_source_shortest_path_length(G, s).items():
+            if v != s:
+                total[v] += d
+                count[v] += 1
+    size = {}
+    for component in networkx.connected_components(G):
+        for v in component:
+            size[v] = len(component)
+    closeness = {}
+    for v in G.nodes():
+        if count[v] == 0 or n <= 1:
+            closeness[v] = 0.0
         else:
-            p = q
-            if q in RWK_SEQ:
-                continue
-        RWK_SEQ.append(p)
-        Gcopy.remove_node(p)                
-        count += 1
-    
-    # Referral.
-    print("Referral (simultaneous) attack...")
-    Gcopy = G.copy()
-    REF_SIM = []
-    count = 0
-    while count < Vcount:
-        p = random_vertex(G)
-        q = random_neighbor(G, p)
-        if q == None:
-            if not p in REF_SIM:
-                REF_SIM.append(p)
-                count += 1
-        else:
-            if not q in REF_SIM:
-                REF_SIM.append(q)
-                count += 1    
-    print("Referral (sequential) attack...")
-    REF_SEQ = []
-    count = 0
-    while count < Vcount:
-        p = random_vertex(G)
-        q = random_neighbor(G, p)
-        if q == None:
-            if not p in REF_SEQ:
-                REF_SEQ.append(p)
-                Gcopy.remove_node(p)
-                count += 1
-        else:
-            if not q in REF_SEQ:
-                REF_SEQ.append(q)
-                Gcopy.remove_node(q)
-                count += 1    
+            closeness[v] = (1.0 * count[v] / total[v]) \
+                           * (size[v] - 1.0) / (n - 1.0)
+    return closeness
 
-    # Betweenness.
-    print("Betweenness (simultaneous) attack...")
-    Gcopy = G.copy()
-    V = sorted(networkx.betweenness_centrality(Gcopy).items(), 
-               key = operator.itemgetter(1), reverse = True)
-    BET_SIM = [a for a, b in V]
-    print("Betweenness (sequential) attack...")
-    BET_SEQ = []
-    for i in range(1, Vcount - 1):
-        v = V.pop(0)[0]
-        BET_SEQ.append(v)
-        Gcopy.remove_node(v)
-        V = sorted(networkx.betweenness_centrality(Gcopy).items(), 
-                   key = operator.itemgetter(1), reverse = True)
-    
-    # Closeness.
-    print("Closeness (simultaneous) attack...")
-    Gcopy = G.copy()
-    V = sorted(networkx.closeness_centrality(Gcopy).items(), 
-               key = operator.itemgetter(1), reverse = True)
-    CLO_SIM = [a for a, b in V]
-    print("Closeness (sequential) attack...")
-    CLO_SEQ = []
-    for i in range(1, Vcount - 1):
-        v = V.pop(0)[0]
-        CLO_SEQ.append(v)
-        Gcopy.remove_node(v)
-        V = sorted(networkx.closeness_centrality(Gcopy).items(), 
-                   key = operator.itemgetter(1), reverse = True)
+def centrality_function(name, samples = None, seed = None):
+    """
+    Return a function that maps a graph to a map from vertex ids to their 
+    betweenness or closeness (name) centralities; exact if samples is None, 
+    and otherwise approximated from samples pivots (betweenness) or sources 
+    (closeness), chosen using a random stream seeded with seed.
+    """
+    exact = {"betweenness" : networkx.betweenness_centrality,
+             "closeness" : networkx.closeness_centrality}
+    if samples == None:
+        return exact[name]
+    rng = random.Random(seed)
+    if name == "betweenness":
+        return lambda G: networkx.betweenness_centrality(
+            G, k = min(samples, len(G)), seed = rng)
+    return lambda G: sampled_closeness_centrality(G, samples, rng)
 
-    # Degree.
-    print("Degree (simultaneous) attack...")
+def sequential_attack(G, centrality, batch = 1):
+    """
+    Return the order in which the vertices of G are removed by a sequential 
+    attack that repeatedly removes the batch vertices with the highest 
+    centrality, as computed by the centrality function, and recomputes the 
+    centralities of the remaining vertices. With batch = 1, this is the 
+    exact sequential attack; larger batches trade accuracy for a factor of 
+    batch fewer centrality computations.
+    """
     Gcopy = G.copy()
-    V = sorted(networkx.degree_centrality(Gcopy).items(), 
-               key = operator.itemgetter(1), reverse = True)
-    DEG_SIM = [a for a, b in V]
-    print("Degree (sequential) attack...")
-    DEG_SEQ = []
-    for i in range(1, Vcount - 1):
-        v = V.pop(0)[0]
-        DEG_SEQ.append(v)
-        Gcopy.remove_node(v)
-        V = sorted(networkx.degree_centrality(Gcopy).items(), 
+    sequence = []
+    while len(Gcopy) > 0:
+        V = sorted(centrality(Gcopy).items(), 
                    key = operator.itemgetter(1), reverse = True)
+        for v, c in V[:batch]:
+            sequence.append(v)
+            Gcopy.remove_node(v)
+    return sequence
 
-    # Eigenvector.
-    print("Eigenvector (simultaneous) attack...")
-    Gcopy = G.copy()
-    V = sorted(eigenvector_centrality(Gcopy).items(), 
+def sequential_degree_attack(G):
+    """
+    Return the order in which the vertices of G are removed by a sequential 
+    degree attack. Rather than recomputing all the degrees after each 
+    removal, the degrees are kept in a heap and the degree of each neighbor 
+    of a removed vertex is decremented, so the attack takes O(m log n) time. 
+    Ties are broken in favor of the vertex that comes first in G, as in 
+    sequential_attack.
+    """
+    order = dict((v, j) for j, v in enumerate(G.nodes()))
+    degree = dict((v, len(G[v])) for v in G.nodes())
+    heap = [(-degree[v], order[v], v) for v in G.nodes()]
+    heapq.heapify(heap)
+    removed = set()
+    sequence = []
+    while heap:
+        d, j, v = heapq.heappop(heap)
+        if v in removed or -d != degree[v]:
+            continue # stale entry
+        sequence.append(v)
+        removed.add(v)
+        for u in G[v]:
+            if not u in removed and u != v:
+                degree[u] -= 1
+                heapq.heappush(heap, (-degree[u], order[u], u))
+    return sequence
+
+def sequential_eigenvector_attack(G, tol = 1e-6, max_iter = 1000):
+    """
+    Return the order in which the vertices of G (with integer labels 
+    0, ..., n - 1) are removed by a sequential eigenvector attack. The 
+    eigenvector centralities are computed by power iteration on A + I 
+    (which has the same principal eigenvector as the adjacency matrix A, 
+    but does not oscillate on bipartite graphs), and after each removal the 
+    iteration is warm-started from the previous centralities, so it usually 
+    converges in a few steps.
+    """
+    indptr, indices = disease.csr_adjacency(G)
+    n = len(G)
+    rows = numpy.repeat(numpy.arange(n), numpy.diff(indptr))
+    alive = numpy.ones(n, dtype = bool)
+    x = numpy.ones(n) / n
+    sequence = []
+    for step in range(n):
+        for iteration in range(max_iter):
+            y = x + numpy.bincount(rows, weights = x[indices], minlength = n)
+            y[~alive] = 0.0
+            norm = numpy.abs(y).sum()
+            if norm == 0:
+                break
+            y /= norm
+            converged = numpy.abs(y - x).sum() < tol
+            x = y
+            if converged:
+                break
+        v = int(numpy.argmax(numpy.where(alive, x, -1.0)))
+        sequence.append(v)
+        alive[v] = False
+        x[v] = 0.0
+    return sequence
+
+class VertexPool(object):
+    """
+    A set of vertices that supports removal of a vertex and sampling of a 
+    vertex uniformly at random, both in constant time.
+    """
+
+    def __init__(self, vertices):
+        self.vertices = list(vertices)
+        self.position = dict((v, j) for j, v in enumerate(self.vertices))
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def remove(self, v):
+        j = self.position.pop(v)
+        last = self.vertices.pop()
+        if last != v:
+            self.vertices[j] = last
+            self.position[last] = j
+
+    def sample(self, u):
+        """
+        Return the vertex picked by the uniform random number u in [0, 1).
+        """
+        return self.vertices[int(u * len(self.vertices))]
+
+def random_walk_attack(G, is_sequential, rng = None):
+    """
+    Return the order in which the vertices of G (with integer labels 
+    0, ..., n - 1) are removed by a random walk attack, in the sequential or 
+    simultaneous mode, using the numpy.random.Generator rng (a fresh, 
+    unseeded one if None). 
+
+    In the simultaneous mode, a random walk on G removes each vertex the 
+    first time it visits it, and jumps to a random vertex when it reaches 
+    an isolated vertex or runs out of vertices to remove in its component. 
+    Visited vertices are kept in a bitmap, the walk runs on the CSR 
+    adjacency structure of G, and the jumps sample from a pool of the 
+    vertices in components that still have unvisited vertices, so each 
+    step takes constant time.
+
+    In the sequential mode, the walk takes a single step from a random 
+    vertex (skipping isolated vertices, which are removed as they are 
+    found); as the vertex it moves to is removed from the graph, the walk 
+    restarts from a random remaining vertex at every subsequent step, so 
+    the remaining vertices are removed in a uniformly random order.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    n = len(G)
+    indptr, indices = [a.tolist() for a in disease.csr_adjacency(G)]
+    u = disease.uniforms(rng, 65536)
+    sequence = []
+    if is_sequential:
+        pool = VertexPool(range(n))
+        while len(pool) > 0:
+            p = pool.sample(next(u))
+            d = indptr[p + 1] - indptr[p]
+            if d > 0:
+                q = indices[indptr[p] + int(next(u) * d)]
+                sequence.append(q)
+                pool.remove(q)
+                break
+            sequence.append(p)
+            pool.remove(p)
+        rest = numpy.array(pool.vertices, dtype = int)
+        return sequence + rng.permutation(rest).tolist()
+
+    # remaining[c] is the number of unvisited vertices in component c.
+    component = [0] * n
+    members = []
+    for c, vertices in enumerate(networkx.connected_components(G)):
+        vertices = list(vertices)
+        for v in vertices:
+            component[v] = c
+        members.append(vertices)
+    remaining = [len(vertices) for vertices in members]
+    pool = VertexPool(range(n))
+    visited = bytearray(n)
+
+    def visit(v):
+        visited[v] = 1
+        sequence.append(v)
+        c = component[v]
+        remaining[c] -= 1
+        if remaining[c] == 0:
+            for w in members[c]:
+                pool.remove(w)
+
+    p = pool.sample(next(u))
+    while len(sequence) < n:
+        if remaining[component[p]] == 0:
+            p = pool.sample(next(u))
+            continue
+        d = indptr[p + 1] - indptr[p]
+        if d == 0:
+            visit(p)
+            continue
+        p = indices[indptr[p] + int(next(u) * d)]
+        if not visited[p]:
+            visit(p)
+    return sequence
+
+def referral_attack(G, is_sequential, rng = None):
+    """
+    Return the order in which the vertices of G (with integer labels 
+    0, ..., n - 1) are removed by a referral attack, in the sequential or 
+    simultaneous mode (which behave identically, as the referrals are always
+    made in G), using the numpy.random.Generator rng (a fresh, unseeded one 
+    if None). 
+
+    A referral attack repeatedly picks a random vertex p and removes a 
+    random neighbor of p (or p itself, if it is isolated), unless it has 
+    already been removed. Rather than simulating the picks, most of which 
+    are wasted late in the attack, the order is sampled directly: the next 
+    vertex removed is v with probability proportional to the probability 
+    w(v) that a single pick yields v, so the order is that of the keys 
+    E(v) / w(v), with the E(v) independent exponential random numbers.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    n = len(G)
+    indptr, indices = disease.csr_adjacency(G)
+    degree = numpy.diff(indptr)
+    rows = numpy.repeat(numpy.arange(n), degree)
+    inverse = 1.0 / numpy.maximum(degree, 1)
+    w = numpy.bincount(rows, weights = inverse[indices], minlength = n)
+    w[degree == 0] = 1.0
+    keys = rng.exponential(size = n) / w
+    return numpy.argsort(keys, kind = "stable").tolist()
+
+def simultaneous_attack(G, centrality):
+    """
+    Return the order in which the vertices of G are removed by a 
+    simultaneous attack, ie, in reverse order of their centralities, as 
+    computed by the centrality function.
+    """
+    V = sorted(centrality(G).items(), 
                key = operator.itemgetter(1), reverse = True)
-    EIG_SIM = [a for a, b in V]
-    print("Eigenvector (sequential) attack...")
-    EIG_SEQ = []
-    for i in range(1, Vcount - 1):
-        v = V.pop(0)[0]
-        EIG_SEQ.append(v)
-        Gcopy.remove_node(v)
-        V = sorted(eigenvector_centrality(Gcopy).items(), 
-                   key = operator.itemgetter(1), reverse = True)
+    return [a for a, b in V]
+
+# The attack strategies, in the order in which they are computed, and their 
+# names.
+STRATEGIES = ["RWK", "REF", "BET", "CLO", "DEG", "EIG"]
+NAMES = {"RWK" : "Random walk", "REF" : "Referral", "BET" : "Betweenness", 
+         "CLO" : "Closeness", "DEG" : "Degree", "EIG" : "Eigenvector"}
+
+# The keys of the attack sequences, eg, "DEG_SIM" and "DEG_SEQ".
+KEYS = [strategy + "_" + mode for strategy in STRATEGIES 
+        for mode in ["SIM", "SEQ"]]
+
+def attack(G, key, options, rng = None):
+    """
+    Return the attack sequence of G with the specified key, computed using 
+    the (command-line) options; the random walk and referral attacks draw 
+    their random numbers from the numpy.random.Generator rng.
+    """
+    strategy, mode = key.split("_")
+    is_sequential = mode == "SEQ"
+    print("%s (%s) attack..." %(NAMES[strategy], 
+                                "sequential" if is_sequential 
+                                else "simultaneous"))
+    sys.stdout.flush()
+    if strategy == "RWK":
+        return random_walk_attack(G, is_sequential, rng)
+    if strategy == "REF":
+        return referral_attack(G, is_sequential, rng)
+    if strategy == "DEG":
+        return sequential_degree_attack(G) if is_sequential \
+               else simultaneous_attack(G, networkx.degree_centrality)
+    if strategy == "EIG":
+        return sequential_eigenvector_attack(G) if is_sequential \
+               else simultaneous_attack(G, eigenvector_centrality)
+    if strategy == "BET":
+        centrality = centrality_function("betweenness", 
+                                         options.betweenness_samples, 
+                                         options.seed)
+    else:
+        centrality = centrality_function("closeness", 
+                                         options.closeness_samples, 
+                                         options.seed)
+    return sequential_attack(G, centrality, options.batch) if is_sequential \
+           else simultaneous_attack(G, centrality)
+
+def selected_keys(strategies):
+    """
+    Return the keys of the attack sequences selected by the comma-separated 
+    list of strategies (eg, "DEG,RWK") or keys (eg, "BET_SIM"); RAN, which 
+    needs no attack sequence, is ignored.
+    """
+    keys = []
+    for token in strategies.split(","):
+        token = token.strip().upper()
+        if token in ["", "RAN"]:
+            continue
+        if token in STRATEGIES:
+            keys += [token + "_SIM", token + "_SEQ"]
+        elif token in KEYS:
+            keys.append(token)
+        else:
+            sys.exit("Error: unknown attack strategy %s" %(token))
+    return [key for key in KEYS if key in keys]
+
+def approximation(options):
+    """
+    Return a map that records the approximation parameters used for the 
+    betweenness and closeness attack sequences; all the values are None (or 
+    1, for the batch size) if the sequences are exact.
+    """
+    return {"batch" : options.batch,
+            "betweenness_samples" : options.betweenness_samples,
+            "closeness_samples" : options.closeness_samples,
+            "seed" : options.seed}
+
+# The network used by run_attack, loaded once per process by init_worker.
+worker_network = None
+
+def init_worker(G):
+    """
+    Make the network G available to run_attack in this process.
+    """
+    global worker_network
+    worker_network = G
+
+def run_attack(task):
+    """
+    Carry out a task (key, options, seed) and return the pair (key, attack 
+    sequence), drawing random numbers from a numpy.random.Generator seeded 
+    with the numpy SeedSequence seed.
+    """
+    key, options, seed = task
+    rng = numpy.random.default_rng(seed)
+    return key, attack(worker_network, key, options, rng)
+
+def main(args):
+    """
+    Reads in a network in GraphML format, computes the order in which the 
+    vertices of the network must be removed using various (random walk, 
+    referral, betweenness, closeness, degree, and eigenvector) attack 
+    strategies and simultaneous and sequential attack modes. The orderings 
+    are saved in a store (see sequence_store.py) named after the network 
+    (eg, ba_6.seq for ba_6.graphml). 
     
-    # Pickle the centralities.
-    ofname = ifname.replace(".graphml", ".pkl")
-    outfile = open(ofname, "wb")
-    attack_sequences = {"RWK_SIM" : RWK_SIM,
-                        "RWK_SEQ" : RWK_SEQ,
-                        "REF_SIM" : REF_SIM,
-                        "REF_SEQ" : REF_SEQ,
-                        "BET_SIM" : BET_SIM,
-                        "BET_SEQ" : BET_SEQ,
-                        "CLO_SIM" : CLO_SIM,
-                        "CLO_SEQ" : CLO_SEQ,
-                        "DEG_SIM" : DEG_SIM,
-                        "DEG_SEQ" : DEG_SEQ,
-                        "EIG_SIM" : EIG_SIM,
-                        "EIG_SEQ" : EIG_SEQ}
-    pickle.dump(attack_sequences, outfile)
-    outfile.close()
+    Each ordering is saved as soon as it is computed, and orderings already 
+    in the store that were computed with the same approximation parameters 
+    are not computed again. The selected orderings can be computed in 
+    parallel by a pool of worker processes.
+    """
+    parser = argparse.ArgumentParser(prog = "attack_sequence.py")
+    parser.add_argument("graphml", metavar = "<graphml file>")
+    parser.add_argument("--strategies", default = ",".join(STRATEGIES),
+                        help = "comma-separated list of attack strategies "
+                        "(RWK, REF, BET, CLO, DEG, EIG) or sequence keys "
+                        "(eg, DEG_SEQ) to compute (default: all)")
+    parser.add_argument("--workers", type = int, default = 1,
+                        help = "number of worker processes (default: 1)")
+    parser.add_argument("--batch", type = int, default = 1, 
+                        help = "number of vertices removed per centrality "
+                        "recomputation in the sequential betweenness and "
+                        "closeness attacks (default: 1, ie, exact)")
+    parser.add_argument("--betweenness-samples", type = int, default = None,
+                        help = "number of pivots used to approximate "
+                        "betweenness centralities (default: exact)")
+    parser.add_argument("--closeness-samples", type = int, default = None,
+                        help = "number of sources used to approximate "
+                        "closeness centralities (default: exact)")
+    parser.add_argument("--seed", type = int, default = None,
+                        help = "seed for the random attacks and for the "
+                        "sampling of pivots and sources")
+    options = parser.parse_args(args)
+
+    ifname = options.graphml
+    G = graph_cache.load_graph(ifname)
+
+    # Compute the selected attack sequences that are not in the store yet, 
+    # saving each one as soon as it is done.
+    approx = approximation(options)
+    dirname = sequence_store.store_name(ifname)
+    stored = sequence_store.read_meta(dirname)
+    tasks = [(key, options, 
+              numpy.random.SeedSequence(options.seed, 
+                                        spawn_key = (KEYS.index(key),)))
+             for key in selected_keys(options.strategies) 
+             if stored.get(key) != approx]
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers, init_worker, (G,))
+        results = pool.imap_unordered(run_attack, tasks)
+    else:
+        init_worker(G)
+        results = map(run_attack, tasks)
+    for key, sequence in results:
+        sequence_store.save(dirname, key, sequence, approx)
+    if options.workers > 1:
+        pool.close()
+        pool.join()
         
 if __name__ == "__main__":
     main(sys.argv[1:])
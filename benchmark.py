@@ -0,0 +1,189 @@
+import argparse, attack_sequence, contextlib, disease, json, networkx, numpy
+import platform, sys, time
+
+def growing_random_graph(n, k, seed = None):
+    """
+    Return an exponential (growing random) network with n vertices and mean
+    degree about k, as generated by gr_network.py: each new vertex is joined
+    to k / 2 vertices picked uniformly at random among the ones before it.
+    """
+    rng = numpy.random.default_rng(seed)
+    m = max(k // 2, 1)
+    G = networkx.Graph()
+    G.add_nodes_from(range(n))
+    for v in range(1, n):
+        G.add_edges_from((v, int(u)) for u in rng.integers(0, v, m))
+    return G
+
+def barabasi_albert_graph(n, k, seed = None):
+    """
+    Return a Barabasi-Albert network with n vertices and mean degree about k,
+    like ba_6.graphml.
+    """
+    return networkx.barabasi_albert_graph(n, max(k // 2, 1), seed = seed)
+
+# The network models, mapped to the functions that generate them.
+MODELS = {"gr" : growing_random_graph, "ba" : barabasi_albert_graph}
+
+def timed(f, repeat):
+    """
+    Call f repeat times, and return a pair (seconds, value), where seconds is
+    the shortest time a call took and value is the value of the last call.
+    """
+    best = None
+    for j in range(repeat):
+        start = time.perf_counter()
+        value = f()
+        seconds = time.perf_counter() - start
+        best = seconds if best == None else min(best, seconds)
+    return best, value
+
+def trial_params(options, engine):
+    """
+    Return the simulation parameters (see params.json.sample) for the trial
+    benchmarks of the specified engine.
+    """
+    vaccination = None
+    if options.fraction > 0:
+        vaccination = {"strategy" : options.strategy,
+                       "fraction" : options.fraction,
+                       "is_sequential" : False}
+    return {"trials" : options.trials, "beta" : options.beta,
+            "gamma" : options.gamma, "engine" : engine,
+            "vaccination" : vaccination, "seed" : options.seed}
+
+def benchmark_trials(G, attack_sequences, options, engine):
+    """
+    Time options.trials trials of the disease dynamics on G with the
+    specified engine, and return a map with the results. A trial is first
+    carried out untimed, so that one-off costs, such as the compilation of
+    the sweep kernel by Numba, are not counted.
+    """
+    params = trial_params(options, engine)
+    A = disease.network(G, engine)
+    list(disease.run_trials(A, params, attack_sequences,
+                            [disease.trial_stream(options.seed, 0)]))
+    streams = lambda: [disease.trial_stream(options.seed, k)
+                       for k in range(options.trials)]
+    run = lambda: list(disease.run_trials(A, params, attack_sequences,
+                                          streams()))
+    seconds, results = timed(run, options.repeat)
+    return {"benchmark" : "trials", "engine" : engine,
+            "trials" : options.trials, "seconds" : seconds,
+            "seconds_per_trial" : seconds / options.trials,
+            "r" : float(numpy.mean([R for S, I, R in results]))}
+
+def benchmark_attack(G, options, key):
+    """
+    Time the computation of the attack sequence of G with the specified key,
+    and return a map with the results.
+    """
+    rng = lambda: numpy.random.default_rng(options.seed)
+    with contextlib.redirect_stdout(sys.stderr):
+        seconds, sequence = timed(lambda: attack_sequence.attack(G, key, 
+                                                                 options, 
+                                                                 rng()),
+                                  options.repeat)
+    return {"benchmark" : "attack", "key" : key, "seconds" : seconds}
+
+def main(args):
+    """
+    Generates synthetic networks of several sizes and mean degrees, using the
+    growing random (as in gr_network.py) and Barabasi-Albert models, times
+    trials of the disease dynamics with each of the selected simulation
+    engines (see disease.py) and the computation of each of the selected
+    attack sequences (see attack_sequence.py) on them, and prints the
+    results in JSON format.
+    """
+    parser = argparse.ArgumentParser(prog = "benchmark.py")
+    parser.add_argument("--models", default = "gr,ba",
+                        help = "comma-separated list of network models "
+                        "(gr, ba) (default: gr,ba)")
+    parser.add_argument("--sizes", default = "1000,5000",
+                        help = "comma-separated list of network sizes "
+                        "(default: 1000,5000)")
+    parser.add_argument("--degrees", default = "4,10",
+                        help = "comma-separated list of mean degrees "
+                        "(default: 4,10)")
+    parser.add_argument("--engines",
+                        default = "single_trial,single_trial_csr,"
+                        "single_trial_counts,single_trial_compact,"
+                        "single_trial_numba,single_trial_event,batch_trials",
+                        help = "comma-separated list of simulation engines "
+                        "(default: all)")
+    parser.add_argument("--trials", type = int, default = 10,
+                        help = "number of trials per engine (default: 10)")
+    parser.add_argument("--beta", type = float, default = 0.08,
+                        help = "infection rate (default: 0.08)")
+    parser.add_argument("--gamma", type = float, default = 0.075,
+                        help = "recovery rate (default: 0.075)")
+    parser.add_argument("--strategy", default = "degree_vaccination",
+                        help = "vaccination strategy (default: "
+                        "degree_vaccination)")
+    parser.add_argument("--fraction", type = float, default = 0.0,
+                        help = "vaccination fraction (default: 0)")
+    parser.add_argument("--attacks", default = "RWK,REF,DEG,EIG",
+                        help = "comma-separated list of attack strategies "
+                        "or sequence keys to time, or none (default: "
+                        "RWK,REF,DEG,EIG)")
+    parser.add_argument("--batch", type = int, default = 1,
+                        help = "see attack_sequence.py (default: 1)")
+    parser.add_argument("--betweenness-samples", type = int, default = None,
+                        help = "see attack_sequence.py (default: exact)")
+    parser.add_argument("--closeness-samples", type = int, default = None,
+                        help = "see attack_sequence.py (default: exact)")
+    parser.add_argument("--repeat", type = int, default = 1,
+                        help = "number of times each benchmark is run, "
+                        "the shortest time being reported (default: 1)")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "seed for the networks, trials, and attacks "
+                        "(default: 0)")
+    parser.add_argument("--output", default = None,
+                        help = "file the results are written to (default: "
+                        "STDOUT)")
+    options = parser.parse_args(args)
+
+    keys = [] if options.attacks == "none" \
+           else attack_sequence.selected_keys(options.attacks)
+    engines = options.engines.split(",")
+    results = []
+    for model in options.models.split(","):
+        for n in [int(x) for x in options.sizes.split(",")]:
+            for k in [int(x) for x in options.degrees.split(",")]:
+                G = MODELS[model](n, k, options.seed)
+                network = {"model" : model, "n" : n, "k" : k,
+                           "edges" : G.number_of_edges()}
+                sys.stderr.write("%s n = %d k = %d\n" %(model, n, k))
+
+                # The attack sequence used for vaccination, if any.
+                attack_sequences = {}
+                key = disease.sequence_key(trial_params(options, None))
+                if key != None:
+                    with contextlib.redirect_stdout(sys.stderr):
+                        attack_sequences[key] = attack_sequence.attack(
+                            G, key, options, numpy.random.default_rng(0))
+
+                for engine in engines:
+                    result = benchmark_trials(G, attack_sequences, options,
+                                              engine)
+                    result.update(network)
+                    results.append(result)
+                for key in keys:
+                    result = benchmark_attack(G, options, key)
+                    result.update(network)
+                    results.append(result)
+
+    report = {"python" : platform.python_version(),
+              "numpy" : numpy.__version__,
+              "networkx" : networkx.__version__,
+              "platform" : platform.platform(),
+              "options" : vars(options), "results" : results}
+    outfile = sys.stdout if options.output == None \
+              else open(options.output, "w")
+    json.dump(report, outfile, indent = 4, sort_keys = True)
+    outfile.write("\n")
+    if outfile != sys.stdout:
+        outfile.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
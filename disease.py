@@ -1,13 +1,25 @@
 """
-Usage: python %(script_name)s <params file>
+Usage: python %(script_name)s <params file> [<trial>]
 
 This script simulates disease dynamics on complex networks using the 
 parameters specified in <params file>, and prints the final fractions 
 (s, i, and r) of the susceptible, intected, and recovered individuals, 
-along with the standard deviation of r.
+along with the standard deviation of r (and the number of trials, if it 
+was chosen adaptively). If <trial> is given, only that trial (numbered 
+from 0) of the run, which must be seeded, is carried out, and its final 
+fractions are printed.
 """
 
-import disease, json, networkx, numpy, operator, pickle, random, sys
+import disease, graph_cache, instrumentation, itertools, json, multiprocessing
+import numpy, operator, os, pickle, random, results_store
+import sequence_store, sys, time
+
+# Numba is optional: without it, single_trial_numba falls back to 
+# single_trial_compact.
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # Each individual in the population belongs to one of the following states.
 SUSCEPTIBLE = 0
@@ -23,9 +35,10 @@ def random_vertex(G):
 
 def neighbors(G, i):
     """
-    Return the neighbors of vertex i in G.
+    Return the neighbors of vertex i in G, as a list (networkx 2 and later 
+    return an iterator, which cannot index an array).
     """
-    return G.neighbors(i)
+    return list(G.neighbors(i))
 
 def random_neighbor(G, i):
     """
@@ -34,167 +47,1044 @@ def random_neighbor(G, i):
     l = neighbors(G, i)
     return random.choice(l) if len(l) > 0 else None
 
-def random_vaccination(population, v, attack_sequences, is_sequential):
+# The vaccination strategies, mapped to the prefixes of the keys of the 
+# attack sequences they use (random_vaccination uses none).
+VACCINATIONS = {"random_vaccination" : None,
+                "random_walk_vaccination" : "RWK",
+                "referral_vaccination" : "REF",
+                "betweenness_vaccination" : "BET",
+                "closeness_vaccination" : "CLO",
+                "degree_vaccination" : "DEG",
+                "eigenvector_vaccination" : "EIG"}
+
+# The most recently computed vaccination mask, as a tuple (attack_sequences, 
+# key, v, mask); it is reused by all the trials of a simulation.
+mask_cache = [None]
+
+# The profile (see instrumentation.py) of the trials carried out by this 
+# process, or None if they are not instrumented. It is always accessed as 
+# disease.profile, so that it is the same when this module is run as a 
+# script.
+profile = [None]
+
+def vaccination_mask(attack_sequences, key, v, n):
     """
-    Vaccinate v individuals from the population, at random.
+    Return a boolean mask of the n individuals in the population that marks 
+    the first v individuals in the attack sequence with the specified key.
     """
-    for p in random.sample(range(len(population)), v):
-        population[p] = VACCINATED
+    cached = mask_cache[0]
+    if cached != None and cached[0] is attack_sequences \
+       and cached[1:3] == (key, v) and len(cached[3]) == n:
+        return cached[3]
+    mask = numpy.zeros(n, dtype = bool)
+    mask[numpy.asarray(attack_sequences[key][:v], dtype = numpy.intp)] = True
+    mask_cache[0] = (attack_sequences, key, v, mask)
+    return mask
 
-def random_walk_vaccination(population, v, attack_sequences, is_sequential):
+def vaccinate(population, strategy, v, attack_sequences, is_sequential, 
+              rng):
     """
-    Vaccinate v individuals from the population, by random walk.
+    Vaccinate v individuals from the population using the specified strategy 
+    (see VACCINATIONS): at random (using the numpy.random.Generator rng), or 
+    in the order given by the attack sequence of the strategy, in the 
+    sequential or simultaneous mode.
     """
-    RWK = attack_sequences["RWK_SEQ"] if is_sequential \
-          else attack_sequences["RWK_SIM"]
-    for i in range(v):
-        population[RWK[i]] = VACCINATED
+    if not strategy in VACCINATIONS:
+        raise ValueError("unknown vaccination strategy %s" %(strategy))
+    prefix = VACCINATIONS[strategy]
+    if prefix == None:
+        chosen = rng.choice(len(population), v, replace = False)
+    else:
+        key = prefix + ("_SEQ" if is_sequential else "_SIM")
+        chosen = vaccination_mask(attack_sequences, key, v, len(population))
+    population[chosen] = VACCINATED
 
-def referral_vaccination(population, v, attack_sequences, is_sequential):
+def infection_probability(G, population, i, beta):
     """
-    Vaccinate v individuals from the population, by referral.
+    Return the probability that the specified individual i will be infected 
+    by one of its infected neighbors.
     """
-    REF = attack_sequences["REF_SEQ"] if is_sequential \
-          else attack_sequences["REF_SIM"]
-    for i in range(v):
-        population[REF[i]] = VACCINATED
+    infected_neighbors = numpy.isin(population[neighbors(G, i)],
+                                    INFECTED).sum()
+    return 1 - (1 - beta) ** infected_neighbors
 
-def betweenness_vaccination(population, v, attack_sequences, is_sequential):
+def csr_adjacency(G):
     """
-    Vaccinate v individuals from the population, in reverse order 
-    of betweenness centrality.
+    Return the adjacency structure of G in compressed sparse row (CSR) form, 
+    as a pair (indptr, indices) of int32 arrays; the neighbors of vertex i 
+    are indices[indptr[i]:indptr[i + 1]].
     """
-    BET = attack_sequences["BET_SEQ"] if is_sequential \
-          else attack_sequences["BET_SIM"]
-    for i in range(v):
-        population[BET[i]] = VACCINATED
+    n = len(G)
+    indptr = numpy.zeros(n + 1, dtype = numpy.int32)
+    rows = []
+    for i in range(n):
+        l = list(neighbors(G, i))
+        indptr[i + 1] = indptr[i] + len(l)
+        rows.extend(l)
+    indices = numpy.array(rows, dtype = numpy.int32)
+    return indptr, indices
 
-def closeness_vaccination(population, v, attack_sequences, is_sequential):
+def csr_neighbors(A, i):
     """
-    Vaccinate v individuals from the population, in reverse order 
-    of closeness centrality.
+    Return the neighbors of vertex i in the CSR adjacency structure A.
     """
-    CLO = attack_sequences["CLO_SEQ"] if is_sequential \
-          else attack_sequences["CLO_SIM"]
-    for i in range(v):
-        population[CLO[i]] = VACCINATED
+    indptr, indices = A
+    return indices[indptr[i]:indptr[i + 1]]
 
-def degree_vaccination(population, v, attack_sequences, is_sequential):
+def csr_infection_probability(A, population, i, beta):
     """
-    Vaccinate v individuals from the population, in reverse order 
-    of degree centrality.
+    Return the probability that the specified individual i will be infected 
+    by one of its infected neighbors, using the CSR adjacency structure A.
     """
-    DEG = attack_sequences["DEG_SEQ"] if is_sequential \
-          else attack_sequences["DEG_SIM"]
-    for i in range(v):
-        population[DEG[i]] = VACCINATED
+    infected_neighbors = numpy.count_nonzero(population[csr_neighbors(A, i)] 
+                                             == INFECTED)
+    return 1 - (1 - beta) ** infected_neighbors
 
-def eigenvector_vaccination(population, v, attack_sequences, is_sequential):
+def trial_stream(entropy, k):
     """
-    Vaccinate v individuals from the population, in reverse order 
-    of eigenvector centrality.
+    Return the numpy.random.Generator of trial k of a run whose random 
+    streams are derived from the given SeedSequence entropy (see tasks). 
+    The streams of the trials are independent, and the stream of trial k is 
+    the same however the trials are split among tasks, so any trial of a 
+    seeded run can be replayed on its own (see replay).
     """
-    EIG = attack_sequences["EIG_SEQ"] if is_sequential \
-          else attack_sequences["EIG_SIM"]
-    for i in range(v):
-        population[EIG[i]] = VACCINATED
+    seed = numpy.random.SeedSequence(entropy, spawn_key = (k,))
+    return numpy.random.default_rng(seed)
 
-def infection_probability(G, population, i, beta):
+def uniforms(rng, size = 4096):
     """
-    Return the probability that the specified individual i will be infected 
-    by one of its infected neighbors.
+    Generate uniform random numbers from [0, 1), drawn from the 
+    numpy.random.Generator rng in blocks of the specified size.
     """
-    infected_neighbors = numpy.in1d(population[neighbors(G, i)],
-                                    INFECTED).sum()
-    return 1 - (1 - beta) ** infected_neighbors
+    while True:
+        for u in rng.random(size).tolist():
+            yield u
 
-def single_trial(G, params, attack_sequences):
+def visits(rng, n, count, size = 4096):
     """
-    Carry out a single trial of the disease dynamics and return the 
-    fraction of susceptible, infected, and recovered individuals at the 
-    last time step.
+    Generate count pairs (idx, u), where idx is a random individual from a 
+    population of n and u is a uniform random number from [0, 1), drawn 
+    from the numpy.random.Generator rng in blocks of the specified size.
     """
+    for start in range(0, count, size):
+        m = min(size, count - start)
+        for pair in zip(rng.integers(0, n, m).tolist(), 
+                        rng.random(m).tolist()):
+            yield pair
 
-    # Pick a random value from (0, 1) for beta and gamma if they are None.
-    beta = random.random() if params["beta"] == None else params["beta"]
-    gamma = random.random() if params["gamma"] == None else params["gamma"]
-    
-    # Create a population of n susceptible individuals.
-    n = len(G)
-    population = numpy.repeat([SUSCEPTIBLE], [n])
+def rates(params, rng):
+    """
+    Return the infection and recovery rates (beta and gamma) for a trial, 
+    picking a random value from (0, 1) for either if it is None in params, 
+    using the numpy.random.Generator rng.
+    """
+    beta = rng.random() if params["beta"] == None else params["beta"]
+    gamma = rng.random() if params["gamma"] == None else params["gamma"]
+    return beta, gamma
+
+def initial_population(n, params, attack_sequences, rng):
+    """
+    Return a population of n susceptible individuals, vaccinated as requested 
+    in params and with one susceptible individual infected at random (using 
+    the numpy.random.Generator rng), along with the number v of vaccinated 
+    individuals.
+    """
+    population = numpy.full(n, SUSCEPTIBLE, dtype = numpy.int8)
 
     # Carry out vaccinations if requested.
     v = 0
     if params["vaccination"] != None:
         strategy = params["vaccination"]["strategy"]
         v = int(params["vaccination"]["fraction"] * n)
-        vaccination = getattr(disease, strategy)
         is_sequential = params["vaccination"]["is_sequential"]
-        vaccination(population, v, attack_sequences, is_sequential)
+        with instrumentation.phase(disease.profile[0], "vaccinate"):
+            vaccinate(population, strategy, v, attack_sequences, 
+                      is_sequential, rng)
 
     # Infect one susceptible individual at random. 
     while True:
-        p = random.randint(0, n - 1)
+        p = int(rng.integers(n))
         if population[p] == SUSCEPTIBLE:
             population[p] = INFECTED
             break
 
+    return population, v
+
+def exposed_pairs(population, neighbors_of):
+    """
+    Return the number of pairs of neighbors (i, j) in the population such 
+    that i is infected and j is susceptible, where neighbors_of(i) returns 
+    the neighbors of i. Once there are none left, the susceptible 
+    individuals are safe and the infected ones can only recover, so the 
+    final fractions are known (see finalize).
+    """
+    return sum(numpy.count_nonzero(population[neighbors_of(i)] == SUSCEPTIBLE)
+               for i in numpy.flatnonzero(population == INFECTED).tolist())
+
+def finalize(S, I, R):
+    """
+    Return the final numbers of susceptible, infected, and recovered 
+    individuals of a trial that currently has S susceptible, I infected, and 
+    R recovered individuals and no exposed pairs (see exposed_pairs).
+    """
+    return S, 0, R + I
+
+def record_counters(counters, n, v, S, I, R, sweeps = None, seen = None, 
+                    attempts = None):
+    """
+    Record in the map counters the counters of a trial in a population of n, 
+    v of whom were vaccinated, that was cut short (see finalize) with S 
+    susceptible, I infected, and R recovered individuals, after the given 
+    number of sweeps, in which seen[state] visits were made to individuals 
+    in that state, and the given number of infection attempts, ie, of visits 
+    to susceptible individuals with at least one infected neighbor (if the 
+    engine makes visits). The I infected individuals that finalize counts as 
+    recovered are recorded as finalized rather than as recoveries, and the 
+    visits are the ones actually made, the last sweep being cut short too.
+    """
+    counters.update({"n" : n, "vaccinated" : v, "infections" : n - v - 1 - S, 
+                     "recoveries" : R, "finalized" : I})
+    if sweeps != None:
+        counters.update({"sweeps" : sweeps, "visits" : sum(seen),
+                         "visits_susceptible" : seen[SUSCEPTIBLE],
+                         "visits_infected" : seen[INFECTED],
+                         "visits_recovered" : seen[RECOVERED],
+                         "visits_vaccinated" : seen[VACCINATED],
+                         "infection_attempts" : attempts})
+
+def single_trial(G, params, attack_sequences, rng = None, 
+                 counters = None):
+    """
+    Carry out a single trial of the disease dynamics, drawing random numbers 
+    from the numpy.random.Generator rng (a fresh, unseeded one if None), and 
+    return the fraction of susceptible, infected, and recovered individuals 
+    at the last time step. If counters is not None, the counters of the 
+    trial are recorded in it (see record_counters).
+
+    The number of exposed pairs (see exposed_pairs) is kept up to date, and 
+    the trial is cut short as soon as there are none left, which is checked 
+    after every transition: the remaining infected individuals are then 
+    counted as recovered, which they would eventually become, so the final 
+    fractions are unaffected but the sweeps in which only recoveries could 
+    happen are skipped.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = rates(params, rng)
+    n = len(G)
+    population, v = initial_population(n, params, attack_sequences, rng)
+
     S, I, R = n - v - 1, 1, 0
+    exposed = exposed_pairs(population, lambda i: neighbors(G, i))
+    sweeps, seen, attempts = 0, [0, 0, 0, 0], 0
     while True:
-        if I == 0:
+        if exposed == 0:
             break
-        for count in range(1, n + 1):
-            idx = random.randint(0, n - 1)
+        sweeps += 1
+        for idx, u in visits(rng, n, n):
+            if counters != None:
+                seen[population[idx]] += 1
             if population[idx] == SUSCEPTIBLE:
                 p = infection_probability(G, population, idx, beta)
-                if random.random() < p:
+                if counters != None and p > 0:
+                    attempts += 1
+                if u < p:
                     population[idx] = INFECTED
                     S -= 1
                     I += 1
+                    states = population[neighbors(G, idx)]
+                    exposed += numpy.count_nonzero(states == SUSCEPTIBLE) \
+                               - numpy.count_nonzero(states == INFECTED)
+                    if exposed == 0:
+                        break
             elif population[idx] == INFECTED:
-                if random.random() < gamma:
+                if u < gamma:
                     population[idx] = RECOVERED
                     I -= 1
                     R += 1
+                    exposed -= numpy.count_nonzero(
+                        population[neighbors(G, idx)] == SUSCEPTIBLE)
+                    if exposed == 0:
+                        break
             elif population[idx] == RECOVERED:
                 pass
             elif population[idx] == VACCINATED:
                 pass
+    if counters != None:
+        record_counters(counters, n, v, S, I, R, sweeps, seen, attempts)
+    S, I, R = finalize(S, I, R)
+    return 1.0 * S / n, 1.0 * I / n, 1.0 * R / n
+
+def single_trial_csr(A, params, attack_sequences, rng = None, 
+                     counters = None):
+    """
+    Carry out a single trial of the disease dynamics on the CSR adjacency 
+    structure A (see csr_adjacency) and return the fraction of susceptible, 
+    infected, and recovered individuals at the last time step. The dynamics 
+    are the same as those of single_trial, and so is the early termination.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = rates(params, rng)
+    n = len(A[0]) - 1
+    population, v = initial_population(n, params, attack_sequences, rng)
+
+    S, I, R = n - v - 1, 1, 0
+    exposed = exposed_pairs(population, lambda i: csr_neighbors(A, i))
+    sweeps, seen, attempts = 0, [0, 0, 0, 0], 0
+    while True:
+        if exposed == 0:
+            break
+        sweeps += 1
+        for idx, u in visits(rng, n, n):
+            state = population[idx]
+            if counters != None:
+                seen[state] += 1
+            if state == SUSCEPTIBLE:
+                p = csr_infection_probability(A, population, idx, beta)
+                if counters != None and p > 0:
+                    attempts += 1
+                if u < p:
+                    population[idx] = INFECTED
+                    S -= 1
+                    I += 1
+                    states = population[csr_neighbors(A, idx)]
+                    exposed += numpy.count_nonzero(states == SUSCEPTIBLE) \
+                               - numpy.count_nonzero(states == INFECTED)
+                    if exposed == 0:
+                        break
+            elif state == INFECTED:
+                if u < gamma:
+                    population[idx] = RECOVERED
+                    I -= 1
+                    R += 1
+                    exposed -= numpy.count_nonzero(
+                        population[csr_neighbors(A, idx)] == SUSCEPTIBLE)
+                    if exposed == 0:
+                        break
+    if counters != None:
+        record_counters(counters, n, v, S, I, R, sweeps, seen, attempts)
+    S, I, R = finalize(S, I, R)
+    return 1.0 * S / n, 1.0 * I / n, 1.0 * R / n
+
+def single_trial_counts(A, params, attack_sequences, rng = None, 
+                        counters = None):
+    """
+    Carry out a single trial of the disease dynamics on the CSR adjacency 
+    structure A and return the fraction of susceptible, infected, and 
+    recovered individuals at the last time step. The dynamics are the same 
+    as those of single_trial, but the number of infected neighbors of each 
+    individual is kept up to date as individuals get infected or recover, 
+    so the infection probability of a susceptible individual is looked up 
+    rather than recomputed from its neighbors. The trial is cut short as in 
+    single_trial.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = rates(params, rng)
+    n = len(A[0]) - 1
+    population, v = initial_population(n, params, attack_sequences, rng)
+
+    # infected[i] is the number of infected neighbors of individual i, and 
+    # probabilities[k] is the infection probability of a susceptible 
+    # individual with k infected neighbors.
+    infected = numpy.zeros(n, dtype = numpy.int32)
+    for p in numpy.flatnonzero(population == INFECTED):
+        infected[csr_neighbors(A, p)] += 1
+    degree = numpy.diff(A[0])
+    probabilities = 1 - (1 - beta) ** numpy.arange(degree.max() + 1)
+
+    S, I, R = n - v - 1, 1, 0
+    exposed = exposed_pairs(population, lambda i: csr_neighbors(A, i))
+    sweeps, seen, attempts = 0, [0, 0, 0, 0], 0
+    while True:
+        if exposed == 0:
+            break
+        sweeps += 1
+        for idx, u in visits(rng, n, n):
+            state = population[idx]
+            if counters != None:
+                seen[state] += 1
+            if state == SUSCEPTIBLE:
+                k = infected[idx]
+                if counters != None and k > 0:
+                    attempts += 1
+                if k > 0 and u < probabilities[k]:
+                    population[idx] = INFECTED
+                    nbrs = csr_neighbors(A, idx)
+                    infected[nbrs] += 1
+                    exposed += numpy.count_nonzero(population[nbrs] 
+                                                   == SUSCEPTIBLE) - k
+                    S -= 1
+                    I += 1
+                    if exposed == 0:
+                        break
+            elif state == INFECTED:
+                if u < gamma:
+                    population[idx] = RECOVERED
+                    nbrs = csr_neighbors(A, idx)
+                    infected[nbrs] -= 1
+                    exposed -= numpy.count_nonzero(population[nbrs] 
+                                                   == SUSCEPTIBLE)
+                    I -= 1
+                    R += 1
+                    if exposed == 0:
+                        break
+    if counters != None:
+        record_counters(counters, n, v, S, I, R, sweeps, seen, attempts)
+    S, I, R = finalize(S, I, R)
+    return 1.0 * S / n, 1.0 * I / n, 1.0 * R / n
+
+def single_trial_compact(A, params, attack_sequences, rng = None, 
+                         counters = None):
+    """
+    Carry out a single trial of the disease dynamics on the CSR adjacency 
+    structure A and return the fraction of susceptible, infected, and 
+    recovered individuals at the last time step. The dynamics are the same 
+    as those of single_trial_counts (asynchronous updates of individuals 
+    visited in random order), but the individuals visited in a sweep and 
+    the uniform random numbers they use are drawn as two arrays at the start 
+    of the sweep, and the int8 states and the infected neighbor counts are 
+    read through memoryviews, which yield plain Python ints, rather than 
+    through NumPy scalar accesses. The trial is cut short as in single_trial.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = rates(params, rng)
+    n = len(A[0]) - 1
+    population, v = initial_population(n, params, attack_sequences, rng)
+    infected = numpy.zeros(n, dtype = numpy.int32)
+    for p in numpy.flatnonzero(population == INFECTED):
+        infected[csr_neighbors(A, p)] += 1
+    degree = numpy.diff(A[0])
+    probabilities = (1 - (1 - beta) ** numpy.arange(degree.max() + 1)).tolist()
+    state, count = memoryview(population), memoryview(infected)
+
+    S, I, R = n - v - 1, 1, 0
+    exposed = exposed_pairs(population, lambda i: csr_neighbors(A, i))
+    sweeps, seen, attempts = 0, [0, 0, 0, 0], 0
+    while True:
+        if exposed == 0:
+            break
+        sweeps += 1
+        picks = rng.integers(0, n, n).tolist()
+        draws = rng.random(n).tolist()
+        for idx, u in zip(picks, draws):
+            s = state[idx]
+            if counters != None:
+                seen[s] += 1
+            if s == SUSCEPTIBLE:
+                k = count[idx]
+                if counters != None and k > 0:
+                    attempts += 1
+                if k > 0 and u < probabilities[k]:
+                    state[idx] = INFECTED
+                    nbrs = csr_neighbors(A, idx)
+                    infected[nbrs] += 1
+                    exposed += numpy.count_nonzero(population[nbrs] 
+                                                   == SUSCEPTIBLE) - k
+                    S -= 1
+                    I += 1
+                    if exposed == 0:
+                        break
+            elif s == INFECTED:
+                if u < gamma:
+                    state[idx] = RECOVERED
+                    nbrs = csr_neighbors(A, idx)
+                    infected[nbrs] -= 1
+                    exposed -= numpy.count_nonzero(population[nbrs] 
+                                                   == SUSCEPTIBLE)
+                    I -= 1
+                    R += 1
+                    if exposed == 0:
+                        break
+    if counters != None:
+        record_counters(counters, n, v, S, I, R, sweeps, seen, attempts)
+    S, I, R = finalize(S, I, R)
+    return 1.0 * S / n, 1.0 * I / n, 1.0 * R / n
+
+def sweep_kernel(indptr, indices, population, infected, probabilities, 
+                 gamma, picks, draws, tally):
+    """
+    Carry out the visits of a sweep of single_trial_compact, to the 
+    individuals picks, with the uniform random numbers draws, on the CSR 
+    adjacency structure (indptr, indices), updating the states population, 
+    the infected neighbor counts infected, and tally, which counts the 
+    visits to individuals in each state (tally[state]), the infection 
+    attempts (tally[4]), the infections (tally[5]), the recoveries 
+    (tally[6]), and the exposed pairs (tally[7], see exposed_pairs). The 
+    sweep stops as soon as there are no exposed pairs left. This function is 
+    compiled by Numba (see kernel).
+    """
+    for t in range(len(picks)):
+        idx = picks[t]
+        s = population[idx]
+        tally[s] += 1
+        if s == SUSCEPTIBLE:
+            k = infected[idx]
+            if k > 0:
+                tally[4] += 1
+                if draws[t] < probabilities[k]:
+                    population[idx] = INFECTED
+                    for j in range(indptr[idx], indptr[idx + 1]):
+                        infected[indices[j]] += 1
+                        if population[indices[j]] == SUSCEPTIBLE:
+                            tally[7] += 1
+                    tally[7] -= k
+                    tally[5] += 1
+                    if tally[7] == 0:
+                        return
+        elif s == INFECTED:
+            if draws[t] < gamma:
+                population[idx] = RECOVERED
+                for j in range(indptr[idx], indptr[idx + 1]):
+                    infected[indices[j]] -= 1
+                    if population[indices[j]] == SUSCEPTIBLE:
+                        tally[7] -= 1
+                tally[6] += 1
+                if tally[7] == 0:
+                    return
+
+# The compiled sweep_kernel, or None if Numba is not installed.
+kernel = numba.njit(cache = True)(sweep_kernel) if numba != None else None
+
+def single_trial_numba(A, params, attack_sequences, rng = None, 
+                       counters = None):
+    """
+    Carry out a single trial of the disease dynamics on the CSR adjacency 
+    structure A and return the fraction of susceptible, infected, and 
+    recovered individuals at the last time step. The trial is exactly the 
+    one carried out by single_trial_compact with the same random stream, but 
+    each sweep is carried out by the compiled kernel. If Numba is not 
+    installed, single_trial_compact is used instead.
+    """
+    if kernel == None:
+        return single_trial_compact(A, params, attack_sequences, rng, 
+                                    counters)
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = rates(params, rng)
+    indptr, indices = A
+    n = len(indptr) - 1
+    population, v = initial_population(n, params, attack_sequences, rng)
+    infected = numpy.zeros(n, dtype = numpy.int32)
+    for p in numpy.flatnonzero(population == INFECTED):
+        infected[csr_neighbors(A, p)] += 1
+    degree = numpy.diff(indptr)
+    probabilities = 1 - (1 - beta) ** numpy.arange(degree.max() + 1)
+
+    tally = numpy.zeros(8, dtype = numpy.int64)
+    tally[7] = exposed_pairs(population, lambda i: csr_neighbors(A, i))
+    S, I, R = n - v - 1, 1, 0
+    sweeps = 0
+    while tally[7] > 0:
+        sweeps += 1
+        picks = rng.integers(0, n, n)
+        draws = rng.random(n)
+        kernel(indptr, indices, population, infected, probabilities, gamma, 
+               picks, draws, tally)
+        S, I, R = n - v - 1 - int(tally[5]), 1 + int(tally[5] - tally[6]), \
+                  int(tally[6])
+    if counters != None:
+        record_counters(counters, n, v, S, I, R, sweeps, tally[:4].tolist(), 
+                        int(tally[4]))
+    S, I, R = finalize(S, I, R)
     return 1.0 * S / n, 1.0 * I / n, 1.0 * R / n
 
+def single_trial_event(A, params, attack_sequences, rng = None, 
+                       counters = None):
+    """
+    Carry out a single trial of the disease dynamics on the CSR adjacency 
+    structure A and return the fraction of susceptible, infected, and 
+    recovered individuals at the last time step. 
+
+    Rather than visiting random individuals, this event-driven engine only 
+    considers the individuals that can change state, ie, the infected and 
+    the susceptible with at least one infected neighbor. Each of these is 
+    chosen with probability proportional to the probability with which a 
+    visit in single_trial changes its state, so the sequence of transitions, 
+    and hence the final fractions, have the same distribution as in 
+    single_trial, but the cost of a trial is proportional to the number of 
+    transitions rather than to the number of visits.
+    """
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = rates(params, rng)
+    indptr, indices = A
+    n = len(indptr) - 1
+    population, v = initial_population(n, params, attack_sequences, rng)
+    degree = numpy.diff(indptr)
+
+    # The individuals that can change state are kept in buckets: bucket 0 
+    # holds the infected individuals, and bucket k > 0 holds the susceptible 
+    # individuals with k infected neighbors. rate[b] is the probability that 
+    # a visit changes the state of an individual in bucket b. Empty buckets 
+    # are dropped from members.
+    rate = 1 - (1 - beta) ** numpy.arange(degree.max() + 1)
+    rate[0] = gamma
+    rate = rate.tolist()
+    members = {}
+    bucket = [-1] * n
+    position = [0] * n
+    infected = [0] * n
+
+    def add(i, b):
+        l = members.setdefault(b, [])
+        bucket[i], position[i] = b, len(l)
+        l.append(i)
+
+    def remove(i):
+        b = bucket[i]
+        l = members[b]
+        last = l.pop()
+        if last != i:
+            l[position[i]] = last
+            position[last] = position[i]
+        if len(l) == 0:
+            del members[b]
+        bucket[i] = -1
+
+    def update_neighbors(i, change):
+        for j in indices[indptr[i]:indptr[i + 1]].tolist():
+            infected[j] += change
+            if population[j] == SUSCEPTIBLE:
+                if bucket[j] != -1:
+                    remove(j)
+                if infected[j] > 0:
+                    add(j, infected[j])
+
+    for p in numpy.flatnonzero(population == INFECTED).tolist():
+        add(p, 0)
+        update_neighbors(p, 1)
+
+    # Stop as soon as no susceptible individual has an infected neighbor, as 
+    # in single_trial.
+    S, I, R = n - v - 1, 1, 0
+    draws = uniforms(rng)
+    while any(b > 0 for b in members):
+        # Pick a bucket with probability proportional to its total rate, and 
+        # an individual from it uniformly at random.
+        weights = [(b, len(l) * rate[b]) for b, l in members.items()]
+        u = next(draws) * sum(w for b, w in weights)
+        for b, w in weights:
+            u -= w
+            if u < 0:
+                break
+        l = members[b]
+        idx = l[int(next(draws) * len(l))]
+        remove(idx)
+        if b == 0:
+            population[idx] = RECOVERED
+            update_neighbors(idx, -1)
+            I -= 1
+            R += 1
+        else:
+            population[idx] = INFECTED
+            add(idx, 0)
+            update_neighbors(idx, 1)
+            S -= 1
+            I += 1
+    if counters != None:
+        record_counters(counters, n, v, S, I, R)
+    S, I, R = finalize(S, I, R)
+    return 1.0 * S / n, 1.0 * I / n, 1.0 * R / n
+
+def csr_expand(A, nodes):
+    """
+    Return the concatenated neighbors of the specified vertices in the CSR 
+    adjacency structure A, along with, for each neighbor, the position in 
+    nodes of the vertex it is a neighbor of.
+    """
+    indptr, indices = A
+    start = indptr[nodes]
+    count = indptr[nodes + 1] - start
+    owner = numpy.repeat(numpy.arange(len(nodes)), count)
+    offset = numpy.arange(count.sum()) \
+             - numpy.repeat(numpy.cumsum(count) - count, count)
+    return indices[numpy.repeat(start, count) + offset], owner
+
+def batch_trials(A, params, attack_sequences, streams):
+    """
+    Carry out trials of the disease dynamics on the CSR adjacency structure 
+    A, all at once, one per numpy.random.Generator in the list streams, and 
+    return a list containing the fraction of susceptible, infected, and 
+    recovered individuals at the last time step of each trial.
+
+    The states of the replicas are stored as the rows of a (trials, n) int8 
+    matrix and the replicas are advanced in lockstep: at each update, every 
+    replica visits one random individual, and the transitions of all the 
+    replicas are carried out with a handful of vectorized operations. Each 
+    replica follows the same dynamics as single_trial, draws its random 
+    numbers from its own stream, so its result does not depend on the other 
+    replicas in the batch, and is dropped from the batch once it has no 
+    infected individuals left.
+    """
+    trials = len(streams)
+    indptr, indices = A
+    n = len(indptr) - 1
+    degree = numpy.diff(indptr)
+
+    # Setup the replicas; infected[r, i] is the number of infected neighbors 
+    # of individual i in replica r.
+    population = numpy.empty((trials, n), dtype = numpy.int8)
+    counts = numpy.int16 if degree.max() < 2 ** 15 else numpy.int32
+    infected = numpy.zeros((trials, n), dtype = counts)
+    beta, gamma = numpy.empty(trials), numpy.empty(trials)
+    S = numpy.empty(trials, dtype = int)
+    for r in range(trials):
+        beta[r], gamma[r] = rates(params, streams[r])
+        population[r], v = initial_population(n, params, attack_sequences, 
+                                              streams[r])
+        for p in numpy.flatnonzero(population[r] == INFECTED):
+            infected[r, csr_neighbors(A, p)] += 1
+        S[r] = n - v - 1
+    I = numpy.ones(trials, dtype = int)
+    R = numpy.zeros(trials, dtype = int)
+    ids = numpy.arange(trials)
+
+    results = [None] * trials
+    block = 1024
+    while len(ids) > 0:
+        m = len(ids)
+        rows = numpy.arange(m) * n
+        flat_population = population.reshape(-1)
+        flat_infected = infected.reshape(-1)
+        for start in range(0, n, block):
+            size = min(block, n - start)
+            picks = numpy.empty((size, m), dtype = numpy.int64)
+            draws = numpy.empty((size, m))
+            for r in range(m):
+                picks[:, r] = streams[ids[r]].integers(0, n, size)
+                draws[:, r] = streams[ids[r]].random(size)
+            for idx, u in zip(rows + picks, draws):
+                state = flat_population[idx]
+                k = flat_infected[idx]
+                infect = (state == SUSCEPTIBLE) & (u < 1 - (1 - beta) ** k)
+                recover = (state == INFECTED) & (u < gamma)
+                for changed, new_state, change in \
+                        ((infect, INFECTED, 1), (recover, RECOVERED, -1)):
+                    if not changed.any():
+                        continue
+                    idx_changed = idx[changed]
+                    flat_population[idx_changed] = new_state
+
+                    # A replica changes at most one individual per update, 
+                    # so the flat indices below are all distinct.
+                    offset = idx_changed - idx_changed % n
+                    nbrs, owner = csr_expand(A, idx_changed % n)
+                    flat_infected[offset[owner] + nbrs] += change
+                S -= infect
+                I += infect
+                I -= recover
+                R += recover
+
+        # Record and drop the replicas that are done.
+        done = I == 0
+        if done.any():
+            for r in numpy.flatnonzero(done):
+                results[ids[r]] = (1.0 * S[r] / n, 1.0 * I[r] / n, 
+                                   1.0 * R[r] / n)
+            keep = ~done
+            population, infected = population[keep], infected[keep]
+            beta, gamma = beta[keep], gamma[keep]
+            S, I, R, ids = S[keep], I[keep], R[keep], ids[keep]
+    return results
+
+def run_trials(G, params, attack_sequences, streams):
+    """
+    Carry out trials of the disease dynamics on G, one per 
+    numpy.random.Generator in the list streams, using the simulation engine 
+    specified in params, and yield the fraction of susceptible, infected, 
+    and recovered individuals at the last time step of each trial. If this 
+    process keeps a profile (see instrumentation.py), the time spent in the 
+    trials and the counters of each trial (except for batch_trials, which 
+    keeps none) are recorded in it.
+    """
+    engine = params.get("engine", "single_trial")
+    if engine == "batch_trials":
+        size = params.get("batch_size", len(streams))
+        for start in range(0, len(streams), size):
+            with instrumentation.phase(disease.profile[0], "simulate"):
+                results = batch_trials(G, params, attack_sequences, 
+                                       streams[start:start + size])
+            for result in results:
+                yield result
+    else:
+        trial = getattr(disease, engine)
+        for rng in streams:
+            if disease.profile[0] == None:
+                yield trial(G, params, attack_sequences, rng)
+                continue
+            counters = disease.profile[0].trial()
+            with disease.profile[0].phase("simulate"):
+                start = time.perf_counter()
+                result = trial(G, params, attack_sequences, rng, counters)
+                counters["seconds"] = time.perf_counter() - start
+            yield result
+
+def network(G, engine):
+    """
+    Return the network G in the form expected by the specified simulation 
+    engine: the networkx graph itself for single_trial, and its CSR 
+    adjacency structure for the other engines.
+    """
+    return G if engine == "single_trial" else csr_adjacency(G)
+
+def sequence_key(params):
+    """
+    Return the key (eg, "DEG_SEQ") of the attack sequence used by the 
+    vaccination strategy in params, or None if it uses none.
+    """
+    vaccination = params["vaccination"]
+    if vaccination == None or VACCINATIONS.get(vaccination["strategy"]) \
+       == None:
+        return None
+    return VACCINATIONS[vaccination["strategy"]] \
+           + ("_SEQ" if vaccination["is_sequential"] else "_SIM")
+
+def report_approximation(params, attack_sequences):
+    """
+    Write a note to STDERR if the vaccination strategy in params uses attack 
+    sequences that were computed approximately (see attack_sequence.py).
+    """
+    key = sequence_key(params)
+    if key == None or not key[:3] in ["BET", "CLO"]:
+        return
+    approximation = sequence_store.approximation(attack_sequences, key)
+    samples = "betweenness_samples" if key[:3] == "BET" \
+              else "closeness_samples"
+    batch = approximation["batch"] if key.endswith("_SEQ") else 1
+    if approximation[samples] != None or batch > 1:
+        sys.stderr.write("Note: %s uses approximate attack sequences %s\n" \
+                         %(key, approximation))
+
+def load_attack_sequences(path):
+    """
+    Return the attack sequences of the network in the GraphML file path, 
+    from its attack sequence store (see sequence_store.py) if there is one, 
+    in which case each sequence is only read when it is first used, and 
+    from the pickle of its attack sequences otherwise, in which case each 
+    sequence is converted to an int32 array once.
+    """
+    dirname = sequence_store.store_name(path)
+    if os.path.isdir(dirname):
+        return sequence_store.load(dirname)
+    attack_sequences = pickle.load(open(path.replace(".graphml", ".pkl"), 
+                                        "rb"))
+    for key, sequence in attack_sequences.items():
+        if key != "APPROXIMATION":
+            attack_sequences[key] = numpy.asarray(sequence, 
+                                                  dtype = numpy.int32)
+    return attack_sequences
+
+def load(params):
+    """
+    Load and return the network specified in params, in the form expected by 
+    the simulation engine (see network), along with its attack sequences. 
+    The network is read through its cache (see graph_cache.py).
+    """
+    path = params["network_params"]["args"]["path"]
+    with instrumentation.phase(disease.profile[0], "load_graph"):
+        if params.get("engine", "single_trial") == "single_trial":
+            G = graph_cache.load_graph(path)
+        else:
+            G = graph_cache.load_adjacency(path)
+    with instrumentation.phase(disease.profile[0], "load_sequences"):
+        attack_sequences = load_attack_sequences(path)
+    if multiprocessing.current_process().name == "MainProcess":
+        report_approximation(params, attack_sequences)
+        if params.get("engine") == "single_trial_numba" and kernel == None:
+            sys.stderr.write("Note: Numba is not installed, so "
+                             "single_trial_compact is used instead of "
+                             "single_trial_numba\n")
+    return G, attack_sequences
+
+# The network and attack sequences used by run_task, loaded once per process 
+# by init_worker.
+worker_network, worker_attack_sequences = None, None
+
+def init_worker(params, loaded = None):
+    """
+    Make the network and attack sequences specified in params (or the given 
+    pair of already loaded ones) available to run_task in this process, and 
+    start a profile if params["instrument"] is given.
+    """
+    global worker_network, worker_attack_sequences
+    disease.profile[0] = instrumentation.Profile() \
+                         if params.get("instrument") != None else None
+    worker_network, worker_attack_sequences = loaded if loaded != None \
+                                              else load(params)
+
+def tasks(params, trials):
+    """
+    Split the specified number of trials into tasks (params, first, trials, 
+    entropy), each of which carries out the trials first, ..., first + 
+    trials - 1, trial k using the random stream trial_stream(entropy, k), 
+    where entropy is params["seed"] (if any, and fresh entropy otherwise). 
+    The tasks, and hence the results, do not depend on the number of workers 
+    that carry them out.
+    """
+    size = 1
+    if params.get("engine", "single_trial") == "batch_trials":
+        size = params.get("batch_size", trials)
+    entropy = numpy.random.SeedSequence(params.get("seed")).entropy
+    return [(params, first, min(size, trials - first), entropy) 
+            for first in range(0, trials, size)]
+
+def task_streams(task):
+    """
+    Return the list of the random streams of the trials of a task (see 
+    tasks).
+    """
+    params, first, trials, entropy = task
+    return [trial_stream(entropy, k) for k in range(first, first + trials)]
+
+def run_task(task):
+    """
+    Carry out a task (see tasks) on the network loaded by init_worker and 
+    return the list of results (see run_trials), along with what the 
+    profile of this process has recorded since the previous task (see 
+    instrumentation.Profile.drain) if there is one.
+    """
+    results = list(run_trials(worker_network, task[0], 
+                              worker_attack_sequences, task_streams(task)))
+    if disease.profile[0] != None:
+        return results, disease.profile[0].drain()
+    return results
+
+def replay(params, k):
+    """
+    Carry out trial k of the run specified in params (which must specify a 
+    seed) on its own, and return the fraction of susceptible, infected, and 
+    recovered individuals at the last time step, exactly as in the run.
+    """
+    if params.get("seed") == None:
+        raise ValueError("only the trials of seeded runs can be replayed")
+    G, attack_sequences = load(params)
+    rng = trial_stream(params["seed"], k)
+    return next(run_trials(G, params, attack_sequences, [rng]))
+
+def trial_pool(params, loaded = None):
+    """
+    Return a pool of params["workers"] processes, each of which has loaded the 
+    network and attack sequences specified in params, for use with 
+    parallel_trials. If a single worker (the default) is requested, return 
+    None and make the network and attack sequences (or the given pair of 
+    already loaded ones) available in this process instead. If 
+    params["instrument"] is given, this process starts a profile into which 
+    the profiles of the workers are merged (see parallel_trials).
+    """
+    workers = params.get("workers", 1)
+    if workers > 1:
+        disease.profile[0] = instrumentation.Profile() \
+                             if params.get("instrument") != None else None
+        return multiprocessing.Pool(workers, disease.init_worker, (params,))
+    disease.init_worker(params, loaded)
+    return None
+
+def parallel_trials(params, trials, pool = None):
+    """
+    Carry out the specified number of trials of the disease dynamics using 
+    the given pool (see trial_pool), or in this process if pool is None, and 
+    yield the fraction of susceptible, infected, and recovered individuals 
+    at the last time step of each trial, in the same order regardless of the 
+    number of workers. Tasks are handed to the pool in rounds, so that little 
+    work is wasted if the caller stops consuming the results early. If the 
+    trials are instrumented, what the tasks record is merged into the 
+    profile of this process.
+    """
+    pending = tasks(params, trials)
+    if pool == None:
+        chunks = map(disease.run_task, pending)
+    else:
+        size = 8 * params.get("workers", 1)
+        chunks = itertools.chain.from_iterable(
+            pool.imap(disease.run_task, pending[start:start + size]) 
+            for start in range(0, len(pending), size))
+    for chunk in chunks:
+        if params.get("instrument") != None:
+            chunk, recorded = chunk
+            disease.profile[0].merge(recorded)
+        for result in chunk:
+            yield result
+
+def statistics(results, target = None, min_trials = 10):
+    """
+    Return the mean fractions of susceptible, infected, and recovered 
+    individuals over the given results (see run_trials), along with the 
+    standard deviation of the fraction of recovered individuals and the 
+    number of results used. If target is not None, stop consuming results 
+    once at least min_trials (and never fewer than 2, as the standard error 
+    estimated from a single result is 0) of them have been used and the 
+    standard error of the mean fraction of recovered individuals is at most 
+    target.
+    """
+    min_trials = max(min_trials, 2)
+    Sm, Im, Rm, Rv = 0.0, 0.0, 0.0, 0.0
+    t = 0
+    for t, (S, I, R) in enumerate(results, 1):
+        Rm_prev = Rm
+        Sm += (S - Sm) / t
+        Im += (I - Im) / t
+        Rm += (R - Rm) / t
+        Rv += (R - Rm) * (R - Rm_prev)
+        if target != None and t >= min_trials and Rv ** 0.5 / t <= target:
+            break
+    return Sm, Im, Rm, (Rv / max(t, 1)) ** 0.5, t
+
+def simulate(params, pool = None):
+    """
+    Carry out trials of the disease dynamics as specified in params, using 
+    the given pool (see trial_pool), and return the mean fractions of 
+    susceptible, infected, and recovered individuals, the standard deviation 
+    of the fraction of recovered individuals, and the number of trials. 
+    
+    The number of trials is params["trials"], unless params["adaptive"] is 
+    given, in which case trials are carried out until the standard error of 
+    the mean fraction of recovered individuals is at most 
+    params["adaptive"]["target"], using at least 
+    params["adaptive"]["min_trials"] (default: 10, and at least 2) and at 
+    most params["adaptive"]["max_trials"] trials.
+    """
+    adaptive = params.get("adaptive")
+    if adaptive == None:
+        results = parallel_trials(params, params["trials"], pool)
+        return statistics(results)
+    results = parallel_trials(params, adaptive["max_trials"], pool)
+    return statistics(results, adaptive["target"], 
+                      adaptive.get("min_trials", 10))
+
 def main(args):
     """
     Entry point.
     """
-    if len(args) != 2:
+    if len(args) not in [2, 3]:
         sys.exit(__doc__ %{"script_name" : args[0].split("/")[-1]})
 
     # Load the simulation parameters.
     params = json.load((open(args[1], "r")))
-    network_params = params["network_params"]
 
-    # Setup the network.
-    G = networkx.read_graphml(network_params["args"]["path"])
-    G = networkx.convert_node_labels_to_integers(G)
+    # Replay a single trial of the run if requested.
+    if len(args) == 3:
+        print("%.3f\t%.3f\t%.3f" %replay(params, int(args[2])))
+        return
 
-    # Load the attack sequences.
-    fname = network_params["args"]["path"].replace(".graphml", ".pkl")
-    attack_sequences = pickle.load(open(fname, "rb"))
-    
     # Carry out the requested number of trials of the disease dynamics and 
     # average the results.
-    Sm, Im, Rm, Rv = 0.0, 0.0, 0.0, 0.0
-    for t in range(1, params["trials"] + 1):
-        S, I, R = single_trial(G, params, attack_sequences)
-        Rm_prev = Rm
-        Sm += (S - Sm) / t
-        Im += (I - Im) / t
-        Rm += (R - Rm) / t
-        Rv += (R - Rm) * (R - Rm_prev)
+    pool = trial_pool(params)
+    Sm, Im, Rm, Rstd, trials = simulate(params, pool)
+    if pool != None:
+        pool.close()
+
+    # Print the average, along with the number of trials used if it was 
+    # chosen adaptively.
+    if params.get("adaptive") == None:
+        print("%.3f\t%.3f\t%.3f\t%.3f" %(Sm, Im, Rm, Rstd))
+    else:
+        print("%.3f\t%.3f\t%.3f\t%.3f\t%d" %(Sm, Im, Rm, Rstd, trials))
+
+    # Save the profile of the simulation, if it was instrumented.
+    if params.get("instrument") != None:
+        disease.profile[0].write(params["instrument"], params)
 
-    # Print the average
-    print("%.3f\t%.3f\t%.3f\t%.3f" \
-          %(Sm, Im, Rm, (Rv / params["trials"]) ** 0.5))
+    # Record the result in the results store, if one is given.
+    if params.get("results") != None:
+        results_store.append(params["results"], params, Sm, Im, Rm, Rstd,
+                             trials)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -5,9 +5,17 @@ This script simulates disease dynamics on complex networks using the
 parameters specified in <params file>, and prints the time evolution of the 
 final fractions (s, i, and r) of the susceptible, intected, and recovered 
 individuals.
+
+If params["quantiles"] is given (eg, [0.05, 0.5, 0.95]), each line also has 
+the standard deviations of s, i, and r, and then s, i, and r at each of the 
+quantiles, estimated in bounded memory from per-step histograms. If 
+params["trajectories"] is given, the trajectory of every trial is streamed 
+to that file as binary records of type TRAJECTORY (trial, step, s, i, r), 
+which numpy.fromfile can read back.
 """
 
-import disease, json, networkx, numpy, operator, pickle, random, sys
+import disease, disease_verbose, graph_cache, itertools, json
+import multiprocessing, numpy, operator, random, sys
 
 # Each individual in the population belongs to one of the following states.
 SUSCEPTIBLE = 0
@@ -23,9 +31,9 @@ def random_vertex(G):
 
 def neighbors(G, i):
     """
-    Return the neighbors of vertex i in G.
+    Return the neighbors of vertex i in G, as a list.
     """
-    return G.neighbors(i)
+    return list(G.neighbors(i))
 
 def random_neighbor(G, i):
     """
@@ -34,141 +42,194 @@ def random_neighbor(G, i):
     l = neighbors(G, i)
     return random.choice(l) if len(l) > 0 else None
 
-def random_vaccination(population, v, attack_sequences, is_sequential):
+def infection_probability(G, population, i, beta):
     """
-    Vaccinate v individuals from the population, at random.
+    Return the probability that the specified individual i will be infected 
+    by one of its infected neighbors.
     """
-    for p in random.sample(range(len(G)), v):
-        population[p] = VACCINATED
+    infected_neighbors = numpy.isin(population[neighbors(G, i)],
+                                    INFECTED).sum()
+    return 1 - (1 - beta) ** infected_neighbors
 
-def random_walk_vaccination(population, v, attack_sequences, is_sequential):
+class Recorder(object):
     """
-    Vaccinate v individuals from the population, by random walk.
+    A buffer of rows of values (eg, the fractions s, i, and r at each time 
+    step of a trial), preallocated and doubled in size whenever it is full, 
+    so that appending a row takes amortized constant time.
     """
-    RWK = attack_sequences["RWK_SEQ"] if is_sequential \
-          else attack_sequences["RWK_SIM"]
-    for i in range(v):
-        population[RWK[i]] = VACCINATED
 
-def referral_vaccination(population, v, attack_sequences, is_sequential):
-    """
-    Vaccinate v individuals from the population, by referral.
-    """
-    REF = attack_sequences["REF_SEQ"] if is_sequential \
-          else attack_sequences["REF_SIM"]
-    for i in range(v):
-        population[REF[i]] = VACCINATED
+    def __init__(self, columns, capacity = 1024):
+        self.data = numpy.empty((capacity, columns))
+        self.size = 0
 
-def betweenness_vaccination(population, v, attack_sequences, is_sequential):
-    """
-    Vaccinate v individuals from the population, in reverse order 
-    of betweenness centrality.
-    """
-    BET = attack_sequences["BET_SEQ"] if is_sequential \
-          else attack_sequences["BET_SIM"]
-    for i in range(v):
-        population[BET[i]] = VACCINATED
+    def append(self, row):
+        if self.size == len(self.data):
+            self.data = numpy.resize(self.data, (2 * len(self.data), 
+                                                 self.data.shape[1]))
+        self.data[self.size] = row
+        self.size += 1
 
-def closeness_vaccination(population, v, attack_sequences, is_sequential):
-    """
-    Vaccinate v individuals from the population, in reverse order 
-    of closeness centrality.
-    """
-    CLO = attack_sequences["CLO_SEQ"] if is_sequential \
-          else attack_sequences["CLO_SIM"]
-    for i in range(v):
-        population[CLO[i]] = VACCINATED
+    def values(self):
+        """
+        Return a (rows, columns) array of the values appended so far.
+        """
+        return self.data[:self.size]
 
-def degree_vaccination(population, v, attack_sequences, is_sequential):
+class Aggregator(object):
     """
-    Vaccinate v individuals from the population, in reverse order 
-    of degree centrality.
+    Accumulates the time series of trials of different lengths, each of 
+    which is deemed to be padded with its last row to the length of the 
+    longest, so that their mean can be computed at the end. The memory used 
+    is proportional to the length of the longest trial, regardless of the 
+    number of trials.
     """
-    DEG = attack_sequences["DEG_SEQ"] if is_sequential \
-          else attack_sequences["DEG_SIM"]
-    for i in range(v):
-        population[DEG[i]] = VACCINATED
 
-def eigenvector_vaccination(population, v, attack_sequences, is_sequential):
-    """
-    Vaccinate v individuals from the population, in reverse order 
-    of eigenvector centrality.
-    """
-    EIG = attack_sequences["EIG_SEQ"] if is_sequential \
-          else attack_sequences["EIG_SIM"]
-    for i in range(v):
-        population[EIG[i]] = VACCINATED
+    def __init__(self, columns):
+        self.sums = Recorder(columns)
+        self.tails = Recorder(columns)
+        self.tails.append(numpy.zeros(columns))
+        self.count = 0
 
-def infection_probability(G, population, i, beta):
+    def add(self, X):
+        """
+        Add the time series X, a (steps, columns) array.
+        """
+        for recorder in [self.sums, self.tails]:
+            while recorder.size < len(X) + (recorder is self.tails):
+                recorder.append(0.0)
+        self.sums.values()[:len(X)] += X
+        self.tails.values()[len(X)] += X[-1]
+        self.count += 1
+
+    def mean(self):
+        """
+        Return a (steps, columns) array of the mean of the time series added, 
+        each padded with its last row to the length of the longest.
+        """
+        T = self.sums.size
+        padding = numpy.cumsum(self.tails.values()[:T], axis = 0)
+        return (self.sums.values() + padding) / max(self.count, 1)
+
+class BandAggregator(Aggregator):
     """
-    Return the probability that the specified individual i will be infected 
-    by one of its infected neighbors.
+    An Aggregator that also keeps, for each time step, the variance of each 
+    column, its smallest and largest values, and a histogram of its values 
+    (which must lie in [0, 1]) with the specified number of bins, from which 
+    quantiles of the values across trials are estimated. The memory used is 
+    proportional to the length of the longest trial times the number of bins.
     """
-    infected_neighbors = numpy.in1d(population[neighbors(G, i)],
-                                    INFECTED).sum()
-    return 1 - (1 - beta) ** infected_neighbors
 
-def extend(a, b):
+    def __init__(self, columns, bins = 200):
+        Aggregator.__init__(self, columns * (2 + bins))
+        self.columns = columns
+        self.bins = bins
+        self.low, self.high = None, None
+
+    def add(self, X):
+        T, c = X.shape
+        if self.low is None:
+            self.low, self.high = X.copy(), X.copy()
+        else:
+            # Pad the extremes (which, past the end of a trial, are those of 
+            # its last row) and X to the length of the longer of the two.
+            pad = lambda Y, m: numpy.vstack((Y, numpy.repeat(Y[-1:], m, 0)))
+            m = len(self.low)
+            if T > m:
+                self.low, self.high = pad(self.low, T - m), \
+                                      pad(self.high, T - m)
+            Y = pad(X, len(self.low) - T)
+            self.low = numpy.minimum(self.low, Y)
+            self.high = numpy.maximum(self.high, Y)
+        H = numpy.zeros((T, c, self.bins))
+        b = numpy.minimum((X * self.bins).astype(int), self.bins - 1)
+        H[numpy.arange(T)[:, None], numpy.arange(c)[None, :], b] = 1.0
+        Aggregator.add(self, numpy.hstack((X, X ** 2, H.reshape(T, -1))))
+
+    def mean(self):
+        return Aggregator.mean(self)[:, :self.columns]
+
+    def std(self):
+        """
+        Return a (steps, columns) array of the standard deviation of the time 
+        series added.
+        """
+        c = self.columns
+        F = Aggregator.mean(self)
+        return numpy.sqrt(numpy.maximum(F[:, c:2 * c] - F[:, :c] ** 2, 0.0))
+
+    def quantiles(self, Q):
+        """
+        Return a (steps, columns, len(Q)) array of the estimates of the 
+        quantiles Q of the time series added, interpolated linearly within 
+        the parts of the bins of the histograms that lie between the 
+        smallest and largest values seen, so that the estimates are exact 
+        when all the values at a step are equal, and never fall outside the 
+        values seen.
+        """
+        c = self.columns
+        P = Aggregator.mean(self)[:, 2 * c:]
+        P = P.reshape(len(P), c, self.bins)
+        cdf = numpy.cumsum(P, axis = 2)
+        result = numpy.empty(P.shape[:2] + (len(Q),))
+        for j, q in enumerate(Q):
+            b = numpy.minimum((cdf < q).sum(axis = 2), self.bins - 1)
+            below = numpy.take_along_axis(cdf, b[..., None], 2)[..., 0] \
+                    - numpy.take_along_axis(P, b[..., None], 2)[..., 0]
+            mass = numpy.take_along_axis(P, b[..., None], 2)[..., 0]
+            within = numpy.clip((q - below) / numpy.maximum(mass, 1e-12), 
+                                0.0, 1.0)
+            start = numpy.maximum(b / self.bins, self.low)
+            end = numpy.minimum((b + 1) / self.bins, self.high)
+            result[..., j] = numpy.clip(start + within * (end - start), 
+                                        self.low, self.high)
+        return result
+
+# The record type of the trajectory file written by main: the fractions of 
+# susceptible, infected, and recovered individuals at a step of a trial.
+TRAJECTORY = numpy.dtype([("trial", numpy.int32), ("step", numpy.int32), 
+                          ("s", numpy.float32), ("i", numpy.float32), 
+                          ("r", numpy.float32)])
+
+def write_trajectory(outfile, trial, X):
     """
-    Extend the smaller list to the size of the larger, using the last 
-    element of the smaller list.
+    Append the time series X, a (steps, 3) array of the fractions s, i, and 
+    r of the specified trial, to the trajectory file outfile, as records of 
+    type TRAJECTORY.
     """
-    a_size = len(a)
-    b_size = len(b)
-    if a_size < b_size:
-        a = numpy.append(a, [a[-1]] * (b_size - a_size))
-    elif a_size > b_size:
-        b = numpy.append(b, [b[-1]] * (a_size - b_size))
-    return a, b
+    records = numpy.empty(len(X), dtype = TRAJECTORY)
+    records["trial"] = trial
+    records["step"] = numpy.arange(len(X))
+    records["s"], records["i"], records["r"] = X[:, 0], X[:, 1], X[:, 2]
+    records.tofile(outfile)
 
-def single_trial(G, params, attack_sequences):
+def single_trial(G, params, attack_sequences, rng = None):
     """
-    Carry out a single trial of the disease dynamics and return three lists 
-    containing the fraction of susceptible, infected, and recovered 
-    individuals at each time step.
+    Carry out a single trial of the disease dynamics, drawing random numbers 
+    from the numpy.random.Generator rng (a fresh, unseeded one if None), and 
+    return three arrays containing the fraction of susceptible, infected, 
+    and recovered individuals at each time step.
     """
-
-    # Pick a random value from (0, 1) for beta and gamma if they are None.
-    beta = random.random() if params["beta"] == None else params["beta"]
-    gamma = random.random() if params["gamma"] == None else params["gamma"]
-    
-    # Create a population of n susceptible individuals.
+    rng = numpy.random.default_rng() if rng == None else rng
+    beta, gamma = disease.rates(params, rng)
     n = len(G)
-    population = numpy.repeat([SUSCEPTIBLE], [n])
-
-    # Carry out vaccinations if requested.
-    v = 0
-    if params["vaccination"] != None:
-        strategy = params["vaccination"]["strategy"]
-        v = int(params["vaccination"]["fraction"] * n)
-        vaccination = getattr(disease, strategy)
-        is_sequential = params["vaccination"]["is_sequential"]
-        vaccination(population, v, attack_sequences, is_sequential)
-
-    # Infect one susceptible individual at random. 
-    while True:
-        p = random.randint(0, n - 1)
-        if population[p] == SUSCEPTIBLE:
-            population[p] = INFECTED
-            break
+    population, v = disease.initial_population(n, params, attack_sequences, 
+                                               rng)
 
-    S = numpy.array([n - v - 1], dtype = float)
-    I = numpy.array([1], dtype = float)
-    R = numpy.array([0], dtype = float)
+    s, i, r = n - v - 1, 1, 0
+    recorder = Recorder(3)
+    recorder.append((s, i, r))
     while True:
-        s, i, r = S[-1], I[-1], R[-1]
         if i == 0:
             break
-        for count in range(1, n + 1):
-            idx = random.randint(0, n - 1)
+        for idx, u in disease.visits(rng, n, n):
             if population[idx] == SUSCEPTIBLE:
                 p = infection_probability(G, population, idx, beta)
-                if random.random() < p:
+                if u < p:
                     population[idx] = INFECTED
                     s -= 1
                     i += 1
             elif population[idx] == INFECTED:
-                if random.random() < gamma:
+                if u < gamma:
                     population[idx] = RECOVERED
                     i -= 1
                     r += 1
@@ -176,10 +237,39 @@ def single_trial(G, params, attack_sequences):
                 pass
             elif population[idx] == VACCINATED:
                 pass
-        S = numpy.append(S, s)
-        I = numpy.append(I, i)
-        R = numpy.append(R, r)
-    return S / n, I / n, R / n
+        recorder.append((s, i, r))
+    X = recorder.values() / n
+    return X[:, 0], X[:, 1], X[:, 2]
+
+def load(params):
+    """
+    Load and return the network specified in params, read through its cache 
+    (see graph_cache.py), along with its attack sequences.
+    """
+    path = params["network_params"]["args"]["path"]
+    G = graph_cache.load_graph(path)
+    attack_sequences = disease.load_attack_sequences(path)
+    return G, attack_sequences
+
+# The network and attack sequences used by run_task, loaded once per process 
+# by init_worker.
+worker_network, worker_attack_sequences = None, None
+
+def init_worker(params):
+    """
+    Make the network and attack sequences specified in params available to 
+    run_task in this process.
+    """
+    global worker_network, worker_attack_sequences
+    worker_network, worker_attack_sequences = load(params)
+
+def run_task(task):
+    """
+    Carry out a task (see disease.tasks) on the network loaded by init_worker 
+    and return the list of results (see single_trial).
+    """
+    return [single_trial(worker_network, task[0], worker_attack_sequences, rng) 
+            for rng in disease.task_streams(task)]
 
 def main(args):
     """
@@ -190,31 +280,51 @@ def main(args):
 
     # Load the simulation parameters.
     params = json.load((open(args[1], "r")))
-    network_params = params["network_params"]
-
-    # Setup the network.
-    G = networkx.read_graphml(network_params["args"]["path"])
-    G = networkx.convert_node_labels_to_integers(G)
-
-    # Load the attack sequences.
-    fname = network_params["args"]["path"].replace(".graphml", ".pkl")
-    attack_sequences = pickle.load(open(fname, "rb"))
-
-    # Carry out the requested number of trials of the disease dynamics and 
-    # compute basic statistics of the results.
-    Sm, Im, Rm = numpy.array([0.0]), numpy.array([0.0]), numpy.array([0.0])
-    for t in range(1, params["trials"] + 1):
-        S, I, R = single_trial(G, params, attack_sequences)
-        Sm, S = extend(Sm, S)
-        Im, I = extend(Im, I)
-        Rm, R = extend(Rm, R)
-        Sm += (S - Sm) / t
-        Im += (I - Im) / t
-        Rm += (R - Rm) / t
-
-    # Print the averaged results to STDOUT.
-    for i in range(len(Sm)):
-        print "%.3f\t%.3f\t%.3f" %(Sm[i], Im[i], Rm[i])
+
+    # Carry out the trials using params["workers"] (default 1) processes, 
+    # each of which loads the network and attack sequences once.
+    workers = params.get("workers", 1)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, disease_verbose.init_worker, 
+                                    (params,))
+        chunks = pool.imap(disease_verbose.run_task, 
+                           disease.tasks(params, params["trials"]))
+    else:
+        disease_verbose.init_worker(params)
+        chunks = map(disease_verbose.run_task, 
+                     disease.tasks(params, params["trials"]))
+    results = itertools.chain.from_iterable(chunks)
+
+    # Average the results, padding each trial with its last values to the 
+    # length of the longest, and stream the trajectory of each trial to 
+    # params["trajectories"] if requested.
+    Q = params.get("quantiles")
+    aggregator = Aggregator(3) if Q == None else BandAggregator(3)
+    trajectories = None
+    if params.get("trajectories") != None:
+        trajectories = open(params["trajectories"], "wb")
+    for trial, (S, I, R) in enumerate(results):
+        X = numpy.column_stack((S, I, R))
+        aggregator.add(X)
+        if trajectories != None:
+            write_trajectory(trajectories, trial, X)
+    if trajectories != None:
+        trajectories.close()
+    if workers > 1:
+        pool.close()
+    M = aggregator.mean()
+
+    # Print the averaged results to STDOUT, followed, if quantiles were 
+    # requested, by the standard deviations and the requested quantiles.
+    if Q == None:
+        for Sm, Im, Rm in M:
+            print("%.3f\t%.3f\t%.3f" %(Sm, Im, Rm))
+    else:
+        bands = numpy.concatenate((aggregator.std()[:, :, None], 
+                                   aggregator.quantiles(Q)), axis = 2)
+        for t in range(len(M)):
+            row = list(M[t]) + list(bands[t].T.reshape(-1))
+            print("\t".join("%.3f" %(x) for x in row))
 
 if __name__ == "__main__":
     main(sys.argv)
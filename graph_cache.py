@@ -0,0 +1,128 @@
+"""
+A cache of the networks read from GraphML files. The network in a GraphML
+file (eg, ba_6.graphml), with its vertices relabelled 0, ..., n - 1 as by
+networkx.convert_node_labels_to_integers, is stored in a directory next to
+it (eg, ba_6.csr) in compressed sparse row (CSR) form (see
+disease.csr_adjacency), as int32 indptr.npy and indices.npy files that are
+memory-mapped when loaded, along with a meta.json file that identifies the
+version of the GraphML file they were built from. The cache is rebuilt
+whenever the GraphML file has changed, ie, when its size differs from the
+recorded one, or its modification time does and so does its hash.
+"""
+
+import disease, hashlib, json, networkx, numpy, os
+
+def cache_name(path):
+    """
+    Return the name of the cache of the network in the GraphML file path.
+    """
+    return os.path.splitext(path)[0] + ".csr"
+
+def file_hash(path):
+    """
+    Return the SHA-1 hash of the contents of the file path.
+    """
+    sha1 = hashlib.sha1()
+    infile = open(path, "rb")
+    for block in iter(lambda: infile.read(1 << 20), b""):
+        sha1.update(block)
+    infile.close()
+    return sha1.hexdigest()
+
+def is_fresh(path, meta):
+    """
+    Return True if the cache metadata meta describes the current version of
+    the GraphML file path.
+    """
+    stat = os.stat(path)
+    if meta.get("size") != stat.st_size:
+        return False
+    return meta.get("mtime") == stat.st_mtime \
+           or meta.get("sha1") == file_hash(path)
+
+def write_meta(dirname, meta, suffix):
+    """
+    Atomically write the cache metadata meta to the meta.json file of the
+    cache directory dirname, through a temporary file with the given suffix.
+    """
+    fname = os.path.join(dirname, "meta.json")
+    outfile = open(fname + suffix, "w")
+    json.dump(meta, outfile)
+    outfile.close()
+    os.rename(fname + suffix, fname)
+
+def save(path, directed, indptr, indices):
+    """
+    Save the CSR adjacency structure (indptr, indices) of the network in the
+    GraphML file path, which is directed or not, in its cache.
+    """
+    dirname = cache_name(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    stat = os.stat(path)
+    meta = {"size" : stat.st_size, "mtime" : stat.st_mtime,
+            "sha1" : file_hash(path), "directed" : directed}
+    suffix = ".%d.tmp" %(os.getpid())
+    for name, a in [("indptr.npy", indptr), ("indices.npy", indices)]:
+        fname = os.path.join(dirname, name)
+        outfile = open(fname + suffix, "wb")
+        numpy.save(outfile, a)
+        outfile.close()
+        os.rename(fname + suffix, fname)
+    write_meta(dirname, meta, suffix)
+
+def load(path):
+    """
+    Return a pair (directed, (indptr, indices)), where directed is True if
+    the network in the GraphML file path is directed and (indptr, indices)
+    is its memory-mapped CSR adjacency structure, from its cache if it is
+    fresh, and from the GraphML file (refreshing the cache, if it can be 
+    written) otherwise. If
+    the cache is found fresh by its hash after the GraphML file was touched,
+    the new modification time is recorded, so that later loads need not
+    hash the file again.
+    """
+    dirname = cache_name(path)
+    fname = os.path.join(dirname, "meta.json")
+    if os.path.exists(fname):
+        meta = json.load(open(fname, "r"))
+        if is_fresh(path, meta):
+            mtime = os.stat(path).st_mtime
+            if meta["mtime"] != mtime:
+                meta["mtime"] = mtime
+                try:
+                    write_meta(dirname, meta, ".%d.tmp" %(os.getpid()))
+                except OSError:
+                    pass # A read-only cache is still usable.
+            return meta["directed"], \
+                   tuple(numpy.asarray(numpy.load(os.path.join(dirname, name),
+                                                  mmap_mode = "r"))
+                         for name in ["indptr.npy", "indices.npy"])
+    G = networkx.read_graphml(path)
+    G = networkx.convert_node_labels_to_integers(G)
+    indptr, indices = disease.csr_adjacency(G)
+    try:
+        save(path, G.is_directed(), indptr, indices)
+    except OSError:
+        pass # The network can still be used without a cache.
+    return G.is_directed(), (indptr, indices)
+
+def load_adjacency(path):
+    """
+    Return the CSR adjacency structure (indptr, indices) of the network in
+    the GraphML file path (see load).
+    """
+    return load(path)[1]
+
+def load_graph(path):
+    """
+    Return the network in the GraphML file path, with its vertices labelled
+    0, ..., n - 1, built from its CSR adjacency structure (see load).
+    """
+    directed, (indptr, indices) = load(path)
+    n = len(indptr) - 1
+    G = networkx.DiGraph() if directed else networkx.Graph()
+    G.add_nodes_from(range(n))
+    rows = numpy.repeat(numpy.arange(n), numpy.diff(indptr))
+    G.add_edges_from(zip(rows.tolist(), indices.tolist()))
+    return G
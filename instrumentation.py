@@ -0,0 +1,90 @@
+"""
+Opt-in instrumentation of the simulations carried out by disease.py. If
+params["instrument"] names a file, every process that carries out trials
+keeps a Profile, which records the time spent in each phase of the
+simulation (loading the network and the attack sequences, vaccinating, and
+simulating the trials) and, for each trial, the counters maintained by the
+simulation engine (see disease.record_counters). The profiles of the worker
+processes are merged into the one of the main process, which is then saved
+as a JSON file. When the instrumentation is off, the engines only test a
+variable against None once per visit.
+"""
+
+import contextlib, json, time
+
+class Profile:
+    """
+    The phase timings and per-trial counters of a simulation.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.trials = []
+        self.inner = 0.0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Return a context manager that adds the time spent in its body to the
+        total time of the specified phase, less the time spent in the phases
+        nested in it (eg, vaccinate in simulate), so that no time is counted
+        twice.
+        """
+        start, outer = time.perf_counter(), self.inner
+        self.inner = 0.0
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed \
+                                - self.inner
+            self.inner = outer + elapsed
+
+    def trial(self):
+        """
+        Return the (empty) map of counters of a new trial.
+        """
+        counters = {}
+        self.trials.append(counters)
+        return counters
+
+    def drain(self):
+        """
+        Return the pair (phases, trials) recorded so far, and start afresh.
+        """
+        data = (self.phases, self.trials)
+        self.phases, self.trials = {}, []
+        return data
+
+    def merge(self, data):
+        """
+        Add the pair (phases, trials) recorded by another profile (see drain)
+        to this profile.
+        """
+        phases, trials = data
+        for name, seconds in phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.trials.extend(trials)
+
+    def write(self, fname, params):
+        """
+        Save the profile of the simulation specified in params in the JSON
+        file fname. Phase timings are summed over all the processes; the
+        duration of a trial includes the time it spent vaccinating.
+        """
+        for k, counters in enumerate(self.trials):
+            counters["trial"] = k
+        data = {"params" : params, "phases" : self.phases,
+                "trials" : self.trials}
+        outfile = open(fname, "w")
+        json.dump(data, outfile, indent = 4, sort_keys = True)
+        outfile.close()
+
+def phase(profile, name):
+    """
+    Return a context manager that times the specified phase in profile (see
+    Profile.phase), or does nothing if profile is None.
+    """
+    if profile == None:
+        return contextlib.nullcontext()
+    return profile.phase(name)
@@ -1,4 +1,4 @@
-import numpy, pandas, sys
+import analysis, numpy, pandas, results_store, sys
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as font_manager
 
@@ -8,9 +8,15 @@ def main(args):
     and vaccination threshold curves for the seven vaccination strategies, 
     obtained from directories with names starting with <prefix>, and saves 
     the plots in files called <prefix>_pindex_curves.pdf and 
-    <prefix>_vstar_curves.pdf
+    <prefix>_vstar_curves.pdf. If a results store (see results_store.py) is 
+    given as a second argument, the curves are instead obtained from the 
+    results for the networks with names starting with <prefix> in the store,
+    using the vaccination mode (SIM or SEQ, default SIM) given as a third
+    argument.
     """
     prefix = args[0]
+    records = results_store.load(args[1]) if len(args) > 1 else None
+    mode = args[2] if len(args) > 2 else "SIM"
     K = range(10, 32, 2)
     P_indices = {"BET" : [], "CLO" : [], "DEG" : [], "EIG" : [], "RAN" : [], 
                  "REF" : [], "RWK" : []}
@@ -19,8 +25,16 @@ def main(args):
     for k in K:
         for suffix in P_indices.keys():
             R = []
-            lines = open("%s_%d_%s/FILES" %(prefix, k, suffix), 
-                         "r").readlines()
+            if len(args) > 1:
+                result = results_store.query(records, k = k, prefix = prefix,
+                                             strategy = 
+                                             results_store.SUFFIXES[suffix],
+                                             is_sequential = mode == "SEQ")
+                R = [round(r, 3) for r in result["r"]]
+                lines = []
+            else:
+                lines = open("%s_%d_%s/FILES" %(prefix, k, suffix), 
+                             "r").readlines()
             for line in lines:
                 try:
                     data = pandas.read_table(line.strip(), header = None)
@@ -29,14 +43,9 @@ def main(args):
                 except:
                     print("Error: %s" %(line))
                     R.append(0)
-            auc = sum([0.01 * r for r in R])
-            P_indices[suffix].append(round(auc, 3))
-            epsilon = 1e-2
-            vstar = 0.0
-            for x in R:
-                if x > epsilon:
-                    vstar += 0.01
-            vstars[suffix].append(round(vstar, 3))
+            V = result["fraction"] if len(args) > 1 else None
+            P_indices[suffix].append(round(analysis.p_index(R, V), 3))
+            vstars[suffix].append(round(analysis.vstar(R, V), 3))
 
     font_prop = font_manager.FontProperties(size = 8)
 
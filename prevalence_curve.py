@@ -1,4 +1,4 @@
-import pandas, pylab, sys
+import analysis, pandas, pylab, sys
 import matplotlib.font_manager as font_manager
 
 def main(args):
@@ -18,13 +18,9 @@ def main(args):
         tail = data.tail(1).values[0]
         R.append(round(tail[2], 3))
         Rerr.append(round(tail[3], 3))
-    auc = sum([0.01 * r for r in R])
+    auc = analysis.p_index(R)
     print("%.3f" %(auc))   # P-index
-    epsilon = 1e-2
-    vstar = 0.0
-    for x in R:
-        if x > epsilon:
-            vstar += 0.01
+    vstar = analysis.vstar(R)
     print("%.3f" %(vstar)) # critical vaccination threshold, vstar
 
     font_prop = font_manager.FontProperties(size = 12)
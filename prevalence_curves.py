@@ -1,4 +1,4 @@
-import numpy, pandas, sys
+import analysis, numpy, pandas, results_store, sys
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as font_manager
 
@@ -7,10 +7,16 @@ def main(args):
     Given a network-related string (say <prefix>), plots the prevalence 
     curves for the seven vaccination strategies, obtained from directories 
     with names starting with <prefix>, and saves the plot in a file called 
-    <prefix>_prevalence_curves.pdf.
+    <prefix>_prevalence_curves.pdf. If a results store (see results_store.py)
+    is given as a second argument, the curves are instead obtained from the
+    results for the network named <prefix> in the store, using the
+    vaccination mode (SIM or SEQ, default SIM) given as a third argument.
     """
     prefix = args[0]
-    V = numpy.arange(0, 1.0, 0.01)
+    records = results_store.load(args[1]) if len(args) > 1 else None
+    mode = args[2] if len(args) > 2 else "SIM"
+    V = dict((suffix, numpy.arange(0, 1.0, 0.01)) 
+             for suffix in ["BET", "CLO", "DEG", "EIG", "RAN", "REF", "RWK"])
     R = {"BET" : [], "CLO" : [], "DEG" : [], "EIG" : [], "RAN" : [], 
          "REF" : [], "RWK" : []}
     P_indices = {"BET" : 0.0, "CLO" : 0.0, "DEG" : 0.0, "EIG" : 0.0, 
@@ -18,7 +24,17 @@ def main(args):
     vstars = {"BET" : 0.0, "CLO" : 0.0, "DEG" : 0.0, "EIG" : 0.0, 
               "RAN" : 0.0, "REF" : 0.0, "RWK" : 0.0}
     for suffix in R.keys():
-        lines = open("%s_%s/FILES" %(prefix, suffix), "r").readlines()
+        if len(args) > 1:
+            result = results_store.query(records, network = prefix, 
+                                         strategy = 
+                                         results_store.SUFFIXES[suffix],
+                                         is_sequential = mode == "SEQ")
+            V[suffix] = result["fraction"]
+            R[suffix] = [round(r, 3) for r in result["r"]]
+            lines = []
+        else:
+            lines = open("%s_%s/FILES" %(prefix, suffix), 
+                         "r").readlines()
         for line in lines:
             try:
                 data = pandas.read_table(line.strip(), header = None)
@@ -27,14 +43,9 @@ def main(args):
             except:
                 print("Error: %s" %(line))
                 R[suffix].append(0)
-        auc = sum([0.01 * r for r in R[suffix]])
-        P_indices[suffix] = round(auc, 3)
-        epsilon = 1e-2
-        vstar = 0.0
-        for x in R[suffix]:
-            if x > epsilon:
-                vstar += 0.01
-        vstars[suffix] = round(vstar, 3)
+        grid = V[suffix] if len(args) > 1 else None
+        P_indices[suffix] = round(analysis.p_index(R[suffix], grid), 3)
+        vstars[suffix] = round(analysis.vstar(R[suffix], grid), 3)
 
     print("%s P-index: %s" %(prefix, P_indices))
     print("%s vstar: %s" %(prefix, vstars))
@@ -43,19 +54,19 @@ def main(args):
     plt.figure(1, figsize = (7, 4.5), dpi = 500)
     plt.xlabel(r"fraction vaccinated $v$", fontproperties = font_prop)
     plt.ylabel(r"prevalence $\pi$", fontproperties = font_prop)
-    plt.plot(V, R["BET"], "b-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["BET"], R["BET"], "b-", linewidth = 1, alpha = 0.6, 
              label = "betweenness")
-    plt.plot(V, R["CLO"], "g-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["CLO"], R["CLO"], "g-", linewidth = 1, alpha = 0.6, 
              label = "closeness")
-    plt.plot(V, R["DEG"], "r-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["DEG"], R["DEG"], "r-", linewidth = 1, alpha = 0.6, 
              label = "degree")
-    plt.plot(V, R["EIG"], "c-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["EIG"], R["EIG"], "c-", linewidth = 1, alpha = 0.6, 
              label = "eigenvector")
-    plt.plot(V, R["RAN"], "m-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["RAN"], R["RAN"], "m-", linewidth = 1, alpha = 0.6, 
              label = "random")
-    plt.plot(V, R["REF"], "y-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["REF"], R["REF"], "y-", linewidth = 1, alpha = 0.6, 
              label = "referral")
-    plt.plot(V, R["RWK"], "k-", linewidth = 1, alpha = 0.6, 
+    plt.plot(V["RWK"], R["RWK"], "k-", linewidth = 1, alpha = 0.6, 
              label = "random walk")
     plt.legend(loc = "upper right", prop = font_prop)
     plt.xlim(0, 1.0)
@@ -0,0 +1,90 @@
+"""
+A columnar store of the results produced by disease.py and sweep.py: a
+single binary file of fixed-size records of type RESULT, one per simulated
+point, keyed by network, mean degree k, vaccination strategy and mode, and
+vaccination fraction. Results are only ever appended to the file, with one
+write per record, so several simulations can share a store; when a point is
+simulated more than once, the last result wins. The store is read back in
+one go with numpy.fromfile, and queried with query.
+"""
+
+import numpy, os
+
+# The record type of a store.
+RESULT = numpy.dtype([("network", "S64"), ("k", numpy.int32),
+                      ("strategy", "S32"), ("is_sequential", numpy.bool_),
+                      ("fraction", numpy.float64), ("s", numpy.float64),
+                      ("i", numpy.float64), ("r", numpy.float64),
+                      ("std", numpy.float64), ("trials", numpy.int32)])
+
+def point(params):
+    """
+    Return the key (network, k, strategy, is_sequential, fraction) of the
+    point simulated with params. The network is named after its GraphML file
+    (eg, ba_6 for ba_6.graphml) and k is params["network_params"]["k"], or -1
+    if it is not given.
+    """
+    network_params = params["network_params"]
+    path = network_params["args"]["path"]
+    network = os.path.splitext(os.path.basename(path))[0]
+    k = network_params.get("k", -1)
+    vaccination = params["vaccination"]
+    if vaccination == None:
+        return network, k, "none", False, 0.0
+    return network, k, vaccination["strategy"], \
+           bool(vaccination["is_sequential"]), vaccination["fraction"]
+
+def append(fname, params, s, i, r, std, trials):
+    """
+    Append to the store fname the result (s, i, r, std, trials) of the point
+    simulated with params.
+    """
+    record = numpy.zeros(1, dtype = RESULT)
+    network, k, strategy, is_sequential, fraction = point(params)
+    record[0] = (network.encode(), k, strategy.encode(), is_sequential,
+                 fraction, s, i, r, std, trials)
+    outfile = open(fname, "ab")
+    outfile.write(record.tobytes())
+    outfile.close()
+
+def load(fname):
+    """
+    Return the records in the store fname.
+    """
+    return numpy.fromfile(fname, dtype = RESULT)
+
+# The suffixes used by the plotting scripts, mapped to the vaccination
+# strategies they stand for.
+SUFFIXES = {"BET" : "betweenness_vaccination",
+            "CLO" : "closeness_vaccination",
+            "DEG" : "degree_vaccination",
+            "EIG" : "eigenvector_vaccination",
+            "RAN" : "random_vaccination",
+            "REF" : "referral_vaccination",
+            "RWK" : "random_walk_vaccination"}
+
+def query(records, network = None, k = None, strategy = None,
+          is_sequential = None, prefix = None):
+    """
+    Return the records that match the given criteria (None matches anything;
+    prefix matches the networks whose names start with it), keeping only the
+    last record of each point, sorted by k and fraction.
+    """
+    mask = numpy.ones(len(records), dtype = bool)
+    if network != None:
+        mask &= records["network"] == network.encode()
+    if prefix != None:
+        mask &= numpy.char.startswith(records["network"], prefix.encode())
+    if k != None:
+        mask &= records["k"] == k
+    if strategy != None:
+        mask &= records["strategy"] == strategy.encode()
+    if is_sequential != None:
+        mask &= records["is_sequential"] == is_sequential
+    selected = records[mask]
+    last = {}
+    for j, record in enumerate(selected):
+        last[(record["network"], record["k"], record["strategy"],
+              record["is_sequential"], round(record["fraction"], 10))] = j
+    selected = selected[sorted(last.values())]
+    return selected[numpy.lexsort((selected["fraction"], selected["k"]))]
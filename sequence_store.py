@@ -0,0 +1,129 @@
+"""
+Usage: python %(script_name)s <pkl file>
+
+Attack sequences (see attack_sequence.py) are stored in a directory named
+after the network (eg, ba_6.seq for ba_6.graphml), with one file of int32
+vertex ids per sequence key (eg, DEG_SEQ.npy), which is memory-mapped when
+loaded, so that only the sequences (and the parts of them) that are actually
+used get read, and a JSON file per sequence key (eg, DEG_SEQ.json) that
+records the approximation parameters the sequence was computed with. Since
+no file is shared by the sequences, attack_sequence.py runs that compute
+different sequences of the same network can save them concurrently. Stores
+written before this layout keep all the parameters in a single meta.json
+file, which is still read.
+
+This script converts the pickled attack sequences in <pkl file> into such a
+store.
+"""
+
+import json, numpy, os, pickle, sys
+
+# The approximation parameters of exact attack sequences, which are assumed
+# for pickled attack sequences that do not record any.
+EXACT = {"batch" : 1, "betweenness_samples" : None,
+         "closeness_samples" : None, "seed" : None}
+
+def store_name(fname):
+    """
+    Return the name of the attack sequence store of the network in the
+    GraphML file (or pickled attack sequences file) fname.
+    """
+    return os.path.splitext(fname)[0] + ".seq"
+
+def read_meta(dirname):
+    """
+    Return a map from keys to the approximation parameters of the attack
+    sequences in the store dirname.
+    """
+    if not os.path.isdir(dirname):
+        return {}
+    fname = os.path.join(dirname, "meta.json")
+    meta = json.load(open(fname, "r")) if os.path.exists(fname) else {}
+    for name in sorted(os.listdir(dirname)):
+        key, ext = os.path.splitext(name)
+        if ext == ".json" and key != "meta":
+            meta[key] = json.load(open(os.path.join(dirname, name), "r"))
+    return meta
+
+def write_atomically(fname, write):
+    """
+    Write the file fname using the function write, which is passed the open
+    file, so that fname is replaced only once it is complete. The temporary
+    file is named after the process, so that processes writing the same
+    file do not clobber each other's temporary files.
+    """
+    suffix = ".%d.tmp" %(os.getpid())
+    outfile = open(fname + suffix, "wb")
+    write(outfile)
+    outfile.close()
+    os.rename(fname + suffix, fname)
+
+def save(dirname, key, sequence, approximation):
+    """
+    Save the attack sequence with the specified key, computed with the given
+    approximation parameters, in the store dirname.
+    """
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    sequence = numpy.asarray(sequence, dtype = numpy.int32)
+    write_atomically(os.path.join(dirname, key + ".npy"),
+                     lambda f: numpy.save(f, sequence))
+    write_atomically(os.path.join(dirname, key + ".json"),
+                     lambda f: f.write(json.dumps(approximation, indent = 4,
+                                                  sort_keys = True).encode()))
+
+class Sequences(dict):
+    """
+    A map from keys to the attack sequences in a store, each of which is
+    memory-mapped the first time it is looked up.
+    """
+
+    def __init__(self, dirname):
+        dict.__init__(self)
+        self.dirname = dirname
+        self.approximations = read_meta(dirname)
+
+    def __missing__(self, key):
+        fname = os.path.join(self.dirname, key + ".npy")
+        if not os.path.exists(fname):
+            raise KeyError(key)
+        self[key] = numpy.load(fname, mmap_mode = "r")
+        return self[key]
+
+def load(dirname):
+    """
+    Return the attack sequences in the store dirname (see Sequences).
+    """
+    return Sequences(dirname)
+
+def approximation(attack_sequences, key):
+    """
+    Return the approximation parameters of the attack sequence with the
+    specified key, from a store or from a map of pickled attack sequences.
+    """
+    if isinstance(attack_sequences, Sequences):
+        return attack_sequences.approximations.get(key, EXACT)
+    return attack_sequences.get("APPROXIMATION", EXACT)
+
+def convert(fname):
+    """
+    Convert the pickled attack sequences in the file fname into a store, and
+    return the name of the store.
+    """
+    attack_sequences = pickle.load(open(fname, "rb"))
+    approx = attack_sequences.pop("APPROXIMATION", EXACT)
+    dirname = store_name(fname)
+    for key, sequence in sorted(attack_sequences.items()):
+        save(dirname, key, sequence, approx)
+    return dirname
+
+def main(args):
+    """
+    Entry point.
+    """
+    if len(args) != 2:
+        sys.exit(__doc__ %{"script_name" : args[0].split("/")[-1]})
+    print(convert(args[1]))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -4,7 +4,9 @@ import matplotlib.font_manager as font_manager
 def main(args):
     """
     Plots the s-i-r curves from the results produced by disease_verbose.py (fed 
-    via STDIN) and saves the plot in a file called sir.pdf.
+    via STDIN) and saves the plot in a file called sir.pdf. If the results 
+    include quantiles, the bands between the lowest and highest ones are 
+    shaded.
     """
     data = pandas.read_table(sys.stdin, header = None)
     font_prop = font_manager.FontProperties(size = 12)
@@ -17,6 +19,12 @@ def main(args):
     pylab.plot(T, S, "b-", linewidth = 2, alpha = 0.6, label = r"$s$")
     pylab.plot(T, I, "g-", linewidth = 2, alpha = 0.6, label = r"$i$")
     pylab.plot(T, R, "r-", linewidth = 2, alpha = 0.6, label = r"$r$")
+    if len(data.columns) >= 12:
+        # Shade the bands between the lowest and highest quantiles.
+        lo, hi = 6, len(data.columns) - 3
+        for j, color in enumerate(["b", "g", "r"]):
+            pylab.fill_between(T, list(data[lo + j]), list(data[hi + j]), 
+                               color = color, alpha = 0.2, linewidth = 0)
     pylab.xlim(0, max(T))
     pylab.ylim(0, 1.0)
     pylab.legend(loc = 'upper right', prop = font_prop)
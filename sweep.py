@@ -0,0 +1,75 @@
+"""
+Usage: python %(script_name)s <params file> <strategies> [<fractions>]
+
+This script simulates disease dynamics on the complex network specified in
+<params file>, for each of the comma-separated vaccination <strategies>
+(eg, degree_vaccination,random_vaccination) and each vaccination fraction
+in <fractions>, given as start:stop:step with stop excluded (default:
+0:1:0.01). All the simulations are carried out in a single process (or pool
+of params["workers"] processes) that loads the network and its attack
+sequences only once. The results are printed as a single table with the
+columns strategy, v, s, i, r, and the standard deviation of r (and the
+number of trials, if it was chosen adaptively). If params["results"] names
+a results store (see results_store.py), every row is also appended to it.
+"""
+
+import copy, disease, json, results_store, sys
+
+def fraction_grid(spec):
+    """
+    Return the list of vaccination fractions described by the string spec of
+    the form start:stop:step, with stop excluded.
+    """
+    start, stop, step = [float(x) for x in spec.split(":")]
+    count = int(round((stop - start) / step))
+    return [round(start + j * step, 10) for j in range(count)]
+
+def sweep(params, strategies, fractions, pool = None):
+    """
+    Carry out params["trials"] trials of the disease dynamics for each of the
+    given vaccination strategies and fractions (or an adaptive number of
+    trials, see disease.simulate), using the given pool (see
+    disease.trial_pool), and yield a tuple (strategy, v, s, i, r, std,
+    trials) for each pair, where s, i, and r are mean fractions, std is the
+    standard deviation of r, and trials is the number of trials used. The
+    results are also appended to the results store params["results"], if
+    given.
+    """
+    for strategy in strategies:
+        for fraction in fractions:
+            point = copy.deepcopy(params)
+            vaccination = point.get("vaccination") or {}
+            vaccination["strategy"] = strategy
+            vaccination["fraction"] = fraction
+            vaccination.setdefault("is_sequential", False)
+            point["vaccination"] = vaccination
+            result = disease.simulate(point, pool)
+            if params.get("results") != None:
+                results_store.append(params["results"], point, *result)
+            yield (strategy, fraction) + result
+
+def main(args):
+    """
+    Entry point.
+    """
+    if len(args) not in [3, 4]:
+        sys.exit(__doc__ %{"script_name" : args[0].split("/")[-1]})
+
+    # Load the simulation parameters and the sweep specification.
+    params = json.load((open(args[1], "r")))
+    strategies = args[2].split(",")
+    fractions = fraction_grid(args[3] if len(args) == 4 else "0:1:0.01")
+
+    # Load the network and attack sequences once, and carry out the sweep.
+    pool = disease.trial_pool(params)
+    for row in sweep(params, strategies, fractions, pool):
+        if params.get("adaptive") == None:
+            print("%s\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f" %row[:-1])
+        else:
+            print("%s\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%d" %row)
+        sys.stdout.flush()
+    if pool != None:
+        pool.close()
+
+if __name__ == "__main__":
+    main(sys.argv)
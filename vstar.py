@@ -0,0 +1,108 @@
+"""
+Usage: python %(script_name)s <params file>
+
+This script estimates the critical vaccination threshold vstar, ie, the
+smallest fraction of vaccinated individuals above which the prevalence r
+(the mean final fraction of recovered individuals) is at most epsilon, for
+the network and vaccination strategy specified in <params file>. Rather than
+simulating a fixed grid of fractions, it bisects the interval [0, 1] of
+fractions, and at each probe carries out only as many trials as are needed
+to decide, with the requested confidence, on which side of epsilon the
+prevalence lies. A probe that runs out of trials before deciding is settled
+by its point estimate, and the interval reported as bracketing vstar only
+relies on the probes that were decided. It prints vstar, the bounds of that
+interval, and the numbers of probes, trials, and undecided probes.
+
+The optional params["vstar"] block may specify epsilon (default: 0.01), the
+width tolerance of the final interval (default: 0.01), the z-score of the
+confidence bounds (default: 2.0), and the minimum (never fewer than 2) and
+maximum numbers of trials per probe (defaults: 10 and params["trials"]).
+"""
+
+import copy, disease, json, sys
+
+def probe(params, fraction, epsilon, z, min_trials, max_trials, pool = None):
+    """
+    Carry out trials of the disease dynamics with the given vaccination
+    fraction until the prevalence is known to be above or below epsilon with
+    confidence z (or max_trials trials have been used), and return a tuple
+    (above, decided, trials), where above is True if the prevalence is
+    deemed to be above epsilon, and decided is False if it was deemed so
+    from the point estimate alone, max_trials trials having been used.
+    """
+    min_trials = max(min_trials, 2)
+    point = copy.deepcopy(params)
+    point["vaccination"]["fraction"] = fraction
+    Rm, Rv = 0.0, 0.0
+    t = 0
+    for t, (S, I, R) in enumerate(disease.parallel_trials(point, max_trials,
+                                                          pool), 1):
+        Rm_prev = Rm
+        Rm += (R - Rm) / t
+        Rv += (R - Rm) * (R - Rm_prev)
+        if t >= min_trials:
+            error = z * Rv ** 0.5 / t
+            if Rm - error > epsilon or Rm + error < epsilon:
+                return Rm > epsilon, True, t
+    return Rm > epsilon, False, t
+
+def find_vstar(params, epsilon = 0.01, tolerance = 0.01, z = 2.0,
+               min_trials = 10, max_trials = 100, pool = None):
+    """
+    Return a tuple (vstar, lo, hi, probes, trials, undecided), where vstar
+    is the estimate of the critical vaccination threshold, [lo, hi] is the
+    interval of fractions known to bracket it, probes and trials are the
+    numbers of fractions probed and of trials carried out, and undecided is
+    the number of probes settled by their point estimates (see probe). The
+    bisection follows the point estimates, but [lo, hi] only narrows on
+    decided probes, so it is wider than the bisection interval if any probe
+    was undecided.
+    """
+    args = (epsilon, z, min_trials, max_trials, pool)
+    above, decided, trials = probe(params, 0.0, *args)
+    undecided = 0 if decided else 1
+    if not above:
+        return 0.0, 0.0, 0.0 if decided else 1.0, 1, trials, undecided
+    lo, hi, probes = 0.0, 1.0, 1
+    known_lo, known_hi = 0.0, 1.0
+    while hi - lo > tolerance:
+        mid = (lo + hi) / 2
+        above, decided, t = probe(params, mid, *args)
+        probes += 1
+        trials += t
+        if above:
+            lo = mid
+        else:
+            hi = mid
+        if not decided:
+            undecided += 1
+        elif above:
+            known_lo = mid
+        else:
+            known_hi = mid
+    return (lo + hi) / 2, known_lo, known_hi, probes, trials, undecided
+
+def main(args):
+    """
+    Entry point.
+    """
+    if len(args) != 2:
+        sys.exit(__doc__ %{"script_name" : args[0].split("/")[-1]})
+
+    # Load the simulation parameters.
+    params = json.load((open(args[1], "r")))
+    options = params.get("vstar", {})
+
+    # Bisect for vstar, loading the network and attack sequences only once.
+    pool = disease.trial_pool(params)
+    result = find_vstar(params, options.get("epsilon", 0.01),
+                        options.get("tolerance", 0.01),
+                        options.get("z", 2.0),
+                        options.get("min_trials", 10),
+                        options.get("max_trials", params["trials"]), pool)
+    if pool != None:
+        pool.close()
+    print("%.3f\t%.3f\t%.3f\t%d\t%d\t%d" %result)
+
+if __name__ == "__main__":
+    main(sys.argv)